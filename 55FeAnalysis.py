@@ -15,6 +15,7 @@ import numpy as np
 import array
 import RootPlotLibs
 import PythonTools
+import PythonTools_IO
 import PythonTools_ROOT
 
 ####################################
@@ -58,44 +59,26 @@ for name in FileNameList:
     RootName = name.replace(".dat", "") + "/" + name.split("/")[-1].replace(".dat", ".root")
     InputFiles.append(ROOT.TFile(RootName, "r"))
 
-# Crack open the files, get the Sum(N) histograms...
-Sum01Histos, Sum09Histos, Sum25Histos = [], [], []
-for inputfile in InputFiles:
-  #print inputfile.keys()
-  if(FileType == "hdf5"):
-    if(VerboseProcessing): print "\tProcessing file:", inputfile.filename + "..."
-    Sum01Histos.append(np.array(inputfile['SummedSum01Vals']))
-    Sum09Histos.append(np.array(inputfile['SummedSum09Vals']))
-    Sum25Histos.append(np.array(inputfile['SummedSum25Vals']))
-  elif(FileType == "root"):
-    Sum01Histos.append(inputfile.Get("SummedSum01Spectrum"))
-    Sum09Histos.append(inputfile.Get("SummedSum09Spectrum"))
-    Sum25Histos.append(inputfile.Get("SummedSum25Spectrum"))
-
-# Now create the global Sum(N) histograms.
-xLo, xHi, xStep = -500., 2000., 10.
-xBins = np.arange(xLo, xHi + xStep, xStep)
-xBinCenters = [x + (0.5 * xStep) for x in xBins[:-1]]
-GlobalSum1Spectrum  = PythonTools_ROOT.MakePixValHisto("GlobalSum01Spectrum", "Global Sum(1) Spectrum",  len(xBins), xLo, xHi, ROOT.kBlack)
-GlobalSum9Spectrum  = PythonTools_ROOT.MakePixValHisto("GlobalSum09Spectrum", "Global Sum(9) Spectrum",  len(xBins), xLo, xHi, ROOT.kBlue)
-GlobalSum25Spectrum = PythonTools_ROOT.MakePixValHisto("GlobalSum25Spectrum", "Global Sum(25) Spectrum", len(xBins), xLo, xHi, ROOT.kRed)
+# Crack open the files, get the Sum(N) histograms, and add them up into the global Sum(N) histograms.
+# We only need the spectra up to 2000 ADC units for the 55Fe peak.
+xLo, xHi = -500., 2000.
+HistoNames = ["GlobalSum01Spectrum", "GlobalSum09Spectrum", "GlobalSum25Spectrum"]
+HistoTitles = ["Global Sum(1) Spectrum", "Global Sum(9) Spectrum", "Global Sum(25) Spectrum"]
+HistoColors = [ROOT.kBlack, ROOT.kBlue, ROOT.kRed]
 if(FileType == "hdf5"):
-  GlobalSum1Vals  = np.zeros(len(Sum01Histos[0]) )
-  GlobalSum9Vals  = np.zeros(len(Sum09Histos[0]) )
-  GlobalSum25Vals = np.zeros(len(Sum25Histos[0]))
-  for i in range(len(InputFiles)):
-    GlobalSum1Vals  += Sum01Histos[i]
-    GlobalSum9Vals  += Sum09Histos[i]
-    GlobalSum25Vals += Sum25Histos[i]
-  for i in range(len(xBinCenters)):
-    GlobalSum1Spectrum.SetBinContent( GlobalSum1Spectrum.FindBin( xBinCenters[i]), GlobalSum1Vals[i] )
-    GlobalSum9Spectrum.SetBinContent( GlobalSum9Spectrum.FindBin( xBinCenters[i]), GlobalSum9Vals[i] )
-    GlobalSum25Spectrum.SetBinContent(GlobalSum25Spectrum.FindBin(xBinCenters[i]), GlobalSum25Vals[i])
+  if(VerboseProcessing): print "\tAdding up the Sum(N) spectra from", len(InputFiles), "files..."
+  GlobalSumHistograms = [PythonTools.SumHistograms(PythonTools_IO.LoadHistogram(inputfile, name) for inputfile in InputFiles)
+                         for name in ['SummedSum01Vals', 'SummedSum09Vals', 'SummedSum25Vals']]
+  GlobalSum1Spectrum, GlobalSum9Spectrum, GlobalSum25Spectrum = [PythonTools_ROOT.MakePixValHistoFromHistogram(name, title, histogram.Slice(xLo, xHi), color)
+                                                                 for name, title, histogram, color in zip(HistoNames, HistoTitles, GlobalSumHistograms, HistoColors)]
 elif(FileType == "root"):
-  for i in range(len(InputFiles)):
-    GlobalSum01Spectrum.Add(Sum01Histos[i], 1.)
-    GlobalSum09Spectrum.Add(Sum09Histos[i], 1.)
-    GlobalSum25Spectrum.Add(Sum25Histos[i], 1.)
+  GlobalSum1Spectrum  = InputFiles[0].Get("SummedSum01Spectrum").Clone(HistoNames[0])
+  GlobalSum9Spectrum  = InputFiles[0].Get("SummedSum09Spectrum").Clone(HistoNames[1])
+  GlobalSum25Spectrum = InputFiles[0].Get("SummedSum25Spectrum").Clone(HistoNames[2])
+  for inputfile in InputFiles[1:]:
+    GlobalSum1Spectrum.Add(inputfile.Get("SummedSum01Spectrum"), 1.)
+    GlobalSum9Spectrum.Add(inputfile.Get("SummedSum09Spectrum"), 1.)
+    GlobalSum25Spectrum.Add(inputfile.Get("SummedSum25Spectrum"), 1.)
 GlobalSumSpectra = [GlobalSum1Spectrum, GlobalSum9Spectrum, GlobalSum25Spectrum]
 
 # Get set up to plot some things.
@@ -17,13 +17,15 @@ import os
 StartTime = time.time()
 
 # Check for the appropriate number of arguments, and proceed if everything looks OK.
-if(len(sys.argv) != 3):
-  print "\tUSAGE: python BatchReadTeamData.py \"/path/to/the/list/of/TEAM/Detector/imges\" ModeNumber"
+if(len(sys.argv) < 3):
+  print "\tUSAGE: python BatchReadTeamData.py \"/path/to/the/list/of/TEAM/Detector/imges\" ModeNumber [Name=Value ...]"
   print "\t       (Don\'t use a \'~\' in the path because it doesn't work with the glob package.)"
   print "\t       \"ModeNumber\" is either a 2 or a 3, corresponding to the trigger mode."
+  print "\t       Any \"Name=Value\" run options get passed along to ReadTEAMData.py."
   exit()
 
 TriggerMode = int(sys.argv[2])
+RunOptionArguments = sys.argv[3:]
 if(TriggerMode == 2):
   print "\tUsing Mode 2 trigger..."
 elif(TriggerMode == 3):
@@ -42,6 +44,7 @@ print "\t...Found", len(FileNameList), "files."
 # Now loop over all those file names and run the read code on each one.
 for filename in FileNameList:
   thisCommand = "python ReadTEAMData.py " + filename + " " + str(TriggerMode)
+  for argument in RunOptionArguments: thisCommand += " " + argument
   os.system(thisCommand)
 
 # Get the end time and report how long this calculation took
@@ -12,6 +12,8 @@ import glob
 import h5py
 import matplotlib.pyplot as plt
 import numpy as np
+import PythonTools
+import PythonTools_IO
 
 ####################################
 #  BEGIN MAIN BODY OF THE CODE!!!  #
@@ -38,27 +40,16 @@ for name in FileNameList:
   HDF5Name = name.replace(".dat", "") + "/" + name.split("/")[-1].replace(".dat", ".hdf5")
   InputFiles.append(h5py.File(HDF5Name, "r"))
 
-# Extract the summed Sum(N) spectra bin values.
-Sum1SpectraVals, Sum9SpectraVals, Sum25SpectraVals = [], [], []
-for thisFile in InputFiles:
-  print "\tProcessing", thisFile.filename.split("/")[-1] + "..."
-  Sum1SpectraVals.append(np.array(thisFile['SummedSum01Vals']))
-  Sum9SpectraVals.append(np.array(thisFile['SummedSum09Vals']))
-  Sum25SpectraVals.append(np.array(thisFile['SummedSum25Vals']))
+# Extract the summed Sum(N) spectra from each file and add them up to get the global ones.  The
+# histograms carry their binning with them, so files binned differently won't get added together.
+print "\tAdding up the summed Sum(N) spectra from", len(InputFiles), "files..."
+GlobalSpectra = [PythonTools.SumHistograms(PythonTools_IO.LoadHistogram(thisFile, name) for thisFile in InputFiles)
+                 for name in ['SummedSum01Vals', 'SummedSum09Vals', 'SummedSum25Vals']]
+GlobalSum1Spectrum, GlobalSum9Spectrum, GlobalSum25Spectrum = [spectrum.Values for spectrum in GlobalSpectra]
 
-# Now sum each of the Sum(N) spectra to get the global ones...
-GlobalSum1Spectrum  = np.zeros(len(Sum1SpectraVals[0]) )
-GlobalSum9Spectrum  = np.zeros(len(Sum9SpectraVals[0]) )
-GlobalSum25Spectrum = np.zeros(len(Sum25SpectraVals[0]))
-for i in range(len(InputFiles)):
-  GlobalSum1Spectrum  += Sum1SpectraVals[i]
-  GlobalSum9Spectrum  += Sum9SpectraVals[i]
-  GlobalSum25Spectrum += Sum25SpectraVals[i]
-
-# Set up the x axis bins for these histograms.  These should really get read out of the hdf5 file...
-xLo, xHi, xStep = InputFiles[0]['xAxisParams'][0], InputFiles[0]['xAxisParams'][1], InputFiles[0]['xAxisParams'][2]
-xBins = np.arange(xLo, xHi + xStep, xStep)
-xBinCenters = [x + (0.5 * xStep) for x in xBins[:-1]]
+# Set up the x axis bins for these histograms.
+xLo, xHi, xStep = GlobalSpectra[0].xLo, GlobalSpectra[0].xHi, GlobalSpectra[0].xStep
+xBinCenters = GlobalSpectra[0].BinCenters()
 
 # Now, plot each of the global Sum(N) histograms as a function of the value of the bin center.
 plt.figure(num=None, figsize=(16, 9), dpi=80, facecolor='w', edgecolor='k')
@@ -85,15 +76,11 @@ import ROOT
 import PythonTools_ROOT
 import RootPlotLibs
 ROOT.gStyle.SetOptFit(1)
-Sum1RootHisto  = PythonTools_ROOT.MakePixValHisto("Sum1RootHisto",  "Sum(1) Histogram",  len(xBinCenters), xLo, xHi, ROOT.kBlack)
-Sum9RootHisto  = PythonTools_ROOT.MakePixValHisto("Sum9RootHisto",  "Sum(9) Histogram",  len(xBinCenters), xLo, xHi, ROOT.kBlue)
-Sum25RootHisto = PythonTools_ROOT.MakePixValHisto("Sum25RootHisto", "Sum(25) Histogram", len(xBinCenters), xLo, xHi, ROOT.kRed)
+Sum1RootHisto  = PythonTools_ROOT.MakePixValHistoFromHistogram("Sum1RootHisto",  "Sum(1) Histogram",  GlobalSpectra[0], ROOT.kBlack)
+Sum9RootHisto  = PythonTools_ROOT.MakePixValHistoFromHistogram("Sum9RootHisto",  "Sum(9) Histogram",  GlobalSpectra[1], ROOT.kBlue)
+Sum25RootHisto = PythonTools_ROOT.MakePixValHistoFromHistogram("Sum25RootHisto", "Sum(25) Histogram", GlobalSpectra[2], ROOT.kRed)
 xRangeL, xRangeH = 0., 4000.
 yRangeL, yRangeH = 0.5, 3000.
-for i in range(len(xBinCenters)):
-  Sum1RootHisto.SetBinContent(  Sum1RootHisto.FindBin(xBinCenters[i]), GlobalSum1Spectrum[i] )
-  Sum9RootHisto.SetBinContent(  Sum9RootHisto.FindBin(xBinCenters[i]), GlobalSum9Spectrum[i] )
-  Sum25RootHisto.SetBinContent(Sum25RootHisto.FindBin(xBinCenters[i]), GlobalSum25Spectrum[i])
 # Sum(1)
 FitModel1 = PythonTools_ROOT.GetLandauPlusGaus("FitModel1", 100., 3500., Sum1RootHisto.GetLineColor(), 2, 5000., 400., 200., 10000., 100., 200.)
 Sum1RootHisto.Fit("FitModel1", "LEM", "", 200., 1200.)
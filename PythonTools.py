@@ -7,33 +7,18 @@
 import sys
 import numpy as np
 import matplotlib.pyplot as plt
+import scipy.ndimage.filters as filters
+import scipy.ndimage as ndimage
+import scipy.sparse as sparse
+from scipy.sparse.csgraph import connected_components
+from scipy.spatial import cKDTree
 import os
+from itertools import cycle
 
 def DarkCorrectMode2(rawimages):
   nImages = len(rawimages)
   DarkCorrectedImages = []
-  nPixelsX = rawimages[0].shape[1]
-  nPixelsY = rawimages[0].shape[0]
-  # Construct the median dark image.
-  MedianDarkImage = []
-  print "\tConstructing dark image from median pixel values from all", nImages, "frames."
-  irow = 0
-  nStatusBarSteps = 100
-  for row in range(nPixelsY):
-    irow += 1
-    #print irow, int(float(nPixelsY) / float(nStatusBarSteps))
-    if((nPixelsX >= nStatusBarSteps) and (irow % int(float(nPixelsY) / float(nStatusBarSteps)) == 0)):
-      StatusBar(irow, nPixelsY, nStatusBarSteps)
-    thisDarkRow = [0] * nPixelsX
-    thisDarkRow = np.array(thisDarkRow)
-    for col in range(nPixelsX):
-      thisPixelValueList = []
-      for imageNumber in range(nImages):
-        thisPixelValueList.append(rawimages[imageNumber][row][col])
-      thisDarkRow[col] = np.median(thisPixelValueList)
-    MedianDarkImage.append(thisDarkRow)
-  print 
-  MedianDarkImage = np.array(MedianDarkImage)
+  MedianDarkImage = MakeMedianDarkImage(rawimages)
   # Actually do the dark correction.
   imageNumber = 0
   for rawimage in rawimages:
@@ -44,16 +29,633 @@ def DarkCorrectMode2(rawimages):
     DarkCorrectedImages.append(thisDCImage)
   return DarkCorrectedImages, MedianDarkImage
 
-def DarkCorrectMode3(rawimages):
+# Construct the mode 2 dark image from the median value of each pixel across all of the frames.  The
+# median gets truncated to an integer, same as it always has been, so old results are reproducible.
+def MakeMedianDarkImage(rawimages):
+  return MakeDarkImage(rawimages, "median")
+
+# The per-pixel estimators MakeDarkImage knows how to use.
+DarkEstimators = ["median", "percentile", "trimmedmean", "sigmaclippedmean"]
+
+# Construct a dark image by applying estimator to the values each pixel takes across all of the
+# frames in rawimages (a (frames, rows, columns) array or a TEAMFile).  Everything is done with
+# array operations over the frame axis, rowsperblock rows at a time so that memory use stays
+# bounded no matter how many frames there are.  The options are:
+#   "median":           Median, truncated to an integer.
+#   "percentile":       The given percentile (linear interpolation between frames).
+#   "trimmedmean":      Mean after dropping trimfraction of the frames off of each end.
+#   "sigmaclippedmean": Mean after iteratively dropping values more than nsigma standard deviations
+#                       away from the mean (starting from the median), up to niterations times.
+# Wherever we can, the frames get partially sorted with np.partition rather than fully sorted.
+def MakeDarkImage(rawimages, estimator="median", percentile=50., trimfraction=0.1, nsigma=3., niterations=5, rowsperblock=64):
+  if(estimator not in DarkEstimators):
+    raise ValueError("Unknown dark estimator \'" + estimator + "\'.  Pick one of: " + ", ".join(DarkEstimators) + ".")
+  if(isinstance(rawimages, list)): rawimages = np.array(rawimages)
   nImages = len(rawimages)
-  DarkCorrectedImages = []
-  for imageNumber in range(0, nImages, 2):
-    print "\tDark-correcting exposure", len(DarkCorrectedImages) + 1, "out of", str(nImages / 2) + "..."
-    # Actually do the dark correction.
-    thisDCImage = np.subtract(rawimages[imageNumber + 1], rawimages[imageNumber])
-    # Add the dark corrected image to the list of them, so we can do things with them later in the code. 
-    DarkCorrectedImages.append(thisDCImage)
-  return DarkCorrectedImages
+  nPixelsY, nPixelsX = rawimages[0].shape
+  print "\tConstructing dark image from the", estimator, "of each pixel value across all", nImages, "frames."
+  if(estimator == "median"):
+    DarkImage = np.zeros((nPixelsY, nPixelsX), dtype=int)
+  else:
+    DarkImage = np.zeros((nPixelsY, nPixelsX))
+  for firstRow in range(0, nPixelsY, rowsperblock):
+    lastRow = min(firstRow + rowsperblock, nPixelsY)
+    PixelValues = np.array(rawimages[:, firstRow:lastRow, :])
+    if(estimator == "median"):
+      DarkImage[firstRow:lastRow] = MedianOverFrames(PixelValues)
+    elif(estimator == "percentile"):
+      DarkImage[firstRow:lastRow] = np.percentile(PixelValues, percentile, axis=0)
+    elif(estimator == "trimmedmean"):
+      DarkImage[firstRow:lastRow] = TrimmedMeanOverFrames(PixelValues, trimfraction)
+    elif(estimator == "sigmaclippedmean"):
+      DarkImage[firstRow:lastRow] = SigmaClippedMeanOverFrames(PixelValues, nsigma, niterations)
+  return DarkImage
+
+# A short description of a dark estimator and whichever of its settings matter, e.g.
+# "percentile(25.0)", so that dark images made different ways never get mixed up.
+def DescribeDarkEstimator(estimator="median", percentile=50., trimfraction=0.1, nsigma=3., niterations=5):
+  if(estimator == "percentile"):
+    return estimator + "(" + str(float(percentile)) + ")"
+  elif(estimator == "trimmedmean"):
+    return estimator + "(" + str(float(trimfraction)) + ")"
+  elif(estimator == "sigmaclippedmean"):
+    return estimator + "(" + str(float(nsigma)) + "," + str(int(niterations)) + ")"
+  return estimator
+
+# Median along the first (frame) axis, using a partial sort to find the middle value(s).
+def MedianOverFrames(pixelvalues):
+  nImages = len(pixelvalues)
+  Middle = nImages / 2
+  if(nImages % 2 == 1):
+    return np.partition(pixelvalues, Middle, axis=0)[Middle]
+  Partitioned = np.partition(pixelvalues, [Middle - 1, Middle], axis=0)
+  return 0.5 * (Partitioned[Middle - 1].astype(float) + Partitioned[Middle])
+
+# Mean along the first (frame) axis after dropping the lowest and highest trimfraction of the
+# values.  Partitioning at both cut points is enough to gather the values in between.
+def TrimmedMeanOverFrames(pixelvalues, trimfraction):
+  nImages = len(pixelvalues)
+  nTrim = int(trimfraction * nImages)
+  if((2 * nTrim) >= nImages): nTrim = (nImages - 1) / 2
+  Partitioned = np.partition(pixelvalues, [nTrim, nImages - nTrim - 1], axis=0)
+  return Partitioned[nTrim:nImages - nTrim].mean(axis=0)
+
+# Mean along the first (frame) axis after iteratively clipping values more than nsigma standard
+# deviations away from the mean.  The first pass is centered on the median to keep bright hits
+# from dragging the center around.
+def SigmaClippedMeanOverFrames(pixelvalues, nsigma, niterations):
+  Values = pixelvalues.astype(float)
+  Center = MedianOverFrames(pixelvalues)
+  Sigma = Values.std(axis=0)
+  Keep = (np.abs(Values - Center) <= (nsigma * Sigma))
+  for iteration in range(niterations):
+    nKept = np.maximum(Keep.sum(axis=0), 1)
+    Center = (Values * Keep).sum(axis=0) / nKept
+    Sigma = np.sqrt((((Values - Center) ** 2) * Keep).sum(axis=0) / nKept)
+    NewKeep = (np.abs(Values - Center) <= (nsigma * Sigma))
+    if((NewKeep == Keep).all()): break
+    Keep = NewKeep
+  # If a pixel somehow got every one of its values clipped, just fall back on the last center.
+  nKept = Keep.sum(axis=0)
+  return np.where(nKept > 0, (Values * Keep).sum(axis=0) / np.maximum(nKept, 1), Center)
+
+# Per-pixel median absolute deviation of rawimages from darkimage, rowsperblock rows at a time.  This
+# is a robust measure of how much each pixel's dark level wanders from frame to frame.  It's kept at
+# least 1 ADC unit so that nothing downstream ever has to divide by zero.
+def MakeDarkSpreadImage(rawimages, darkimage, rowsperblock=64):
+  nPixelsY, nPixelsX = rawimages[0].shape
+  SpreadImage = np.zeros((nPixelsY, nPixelsX))
+  for firstRow in range(0, nPixelsY, rowsperblock):
+    lastRow = min(firstRow + rowsperblock, nPixelsY)
+    Deviations = np.abs(np.subtract(rawimages[:, firstRow:lastRow, :], darkimage[firstRow:lastRow], dtype=float))
+    SpreadImage[firstRow:lastRow] = MedianOverFrames(Deviations)
+  return np.maximum(SpreadImage, 1.)
+
+# The ways a RunningDarkModel knows how to update itself.
+DarkModelMethods = ["quantile", "ewma"]
+
+# A per-pixel dark estimate that gets updated a frame at a time, so that it can be carried from one
+# file to the next in a run instead of being rebuilt from scratch for every file.  It keeps a dark
+# image and a per-pixel spread (how far the pixel typically wanders, in ADC units), both as float32.
+#   "quantile": Streaming approximate quantile.  Every frame nudges each pixel's estimate up by
+#               rate * quantile * spread if the new value is above it, and down by
+#               rate * (1 - quantile) * spread if it's below, which settles on the quantile.
+#   "ewma":     Exponentially weighted mean with weight rate, with each frame's deviation from the
+#               estimate clipped to nsigma spreads so that hits don't drag it around.
+# The spread is tracked with an exponentially weighted (and equally clipped) absolute deviation.
+class RunningDarkModel(object):
+  def __init__(self, darkimage, spreadimage, method="quantile", quantile=0.5, rate=0.05, nsigma=5., nimages=0):
+    if(method not in DarkModelMethods):
+      raise ValueError("Unknown dark model method \'" + method + "\'.  Pick one of: " + ", ".join(DarkModelMethods) + ".")
+    self.DarkImage = np.array(darkimage, dtype=np.float32)
+    self.SpreadImage = np.array(spreadimage, dtype=np.float32)
+    self.Method = method
+    self.Quantile = quantile
+    self.Rate = rate
+    self.nSigma = nsigma
+    self.nImages = nimages
+
+  # Fold one raw frame into the model.
+  def Update(self, rawimage):
+    Deviation = np.subtract(rawimage, self.DarkImage, dtype=np.float32)
+    ClipLevel = self.nSigma * self.SpreadImage
+    if(self.Method == "quantile"):
+      self.DarkImage += self.Rate * self.SpreadImage * (self.Quantile - (Deviation < 0.))
+    elif(self.Method == "ewma"):
+      self.DarkImage += self.Rate * np.clip(Deviation, -ClipLevel, ClipLevel)
+    self.SpreadImage += self.Rate * (np.minimum(np.abs(Deviation), ClipLevel) - self.SpreadImage)
+    np.maximum(self.SpreadImage, 1., out=self.SpreadImage)
+    self.nImages += 1
+
+# Start a RunningDarkModel off from a whole stack of frames, using the full dark estimate from
+# MakeDarkImage for the dark level and MakeDarkSpreadImage for the spread.
+def MakeRunningDarkModel(rawimages, darkimage, method="quantile", quantile=0.5, rate=0.05, nsigma=5.):
+  SpreadImage = MakeDarkSpreadImage(rawimages, darkimage)
+  return RunningDarkModel(darkimage, SpreadImage, method, quantile, rate, nsigma, len(rawimages))
+
+# Dark correct a stream of raw frames, yielding (imageNumber, dcimage) as soon as each one comes in.
+# rawimagesource is anything that yields (imageNumber, rawimage), like
+# PythonTools_IO.IterateTEAMImages.  Every frame gets corrected against the model's dark image as it
+# stood when the stream started (darkimage), and is then folded into the model.
+def DarkCorrectWithModelStream(rawimagesource, darkmodel, darkimage):
+  for imageNumber, rawimage in rawimagesource:
+    print "\tDark-correcting exposure", str(imageNumber + 1) + "..."
+    yield imageNumber, np.subtract(rawimage, darkimage)
+    darkmodel.Update(rawimage)
+
+# Dark correct rawimages against darkimage blocksize frames at a time, yielding (imageNumber,
+# dcimage) for each frame.  Only one block of dark-corrected frames is ever held in memory, so the
+# memory footprint is set by blocksize rather than by how many frames are in the file.
+def DarkCorrectMode2Stream(rawimages, darkimage, blocksize):
+  nImages = len(rawimages)
+  for firstImage in range(0, nImages, blocksize):
+    lastImage = min(firstImage + blocksize, nImages)
+    print "\tDark-correcting exposures", firstImage + 1, "through", lastImage, "out of", str(nImages) + "..."
+    DCBlock = np.subtract(rawimages[firstImage:lastImage], darkimage)
+    for i in range(len(DCBlock)):
+      yield firstImage + i, DCBlock[i]
+
+# Dark correct mode 3 data, where even frames (starting from zero) are the darks for the odd frames
+# right after them.  The stack gets treated as (pairs, 2, rows, columns) and every exposure gets
+# dark-corrected in one vectorized subtraction.  The result is written into out (a preallocated
+# (pairs, rows, columns) array) if one is given, otherwise into a new array of dtype.  Either way
+# it's a signed type, so there's no wrapping around when a dark pixel is brighter than the exposure.
+def DarkCorrectMode3(rawimages, out=None, dtype=np.int32):
+  nPairs = len(rawimages) / 2
+  nPixelsY, nPixelsX = rawimages[0].shape
+  print "\tDark-correcting", nPairs, "exposures..."
+  Pairs = np.asarray(rawimages[:2 * nPairs]).reshape(nPairs, 2, nPixelsY, nPixelsX)
+  if(out is None): out = np.empty((nPairs, nPixelsY, nPixelsX), dtype=dtype)
+  np.subtract(Pairs[:, 1], Pairs[:, 0], out=out, dtype=out.dtype)
+  return out
+
+# Dark correct the mode 3 pairs in rawimages blocksize pairs at a time, yielding (pairNumber,
+# dcimage) for each one.  All of the blocks get written into the same preallocated buffer, so each
+# dcimage is only good until the next block comes along.
+def DarkCorrectMode3Blocks(rawimages, blocksize, dtype=np.int32):
+  nPairs = len(rawimages) / 2
+  nPixelsY, nPixelsX = rawimages[0].shape
+  DCBuffer = np.empty((blocksize, nPixelsY, nPixelsX), dtype=dtype)
+  for firstPair in range(0, nPairs, blocksize):
+    lastPair = min(firstPair + blocksize, nPairs)
+    DCBlock = DarkCorrectMode3(rawimages[2 * firstPair:2 * lastPair], DCBuffer[:lastPair - firstPair])
+    for i in range(len(DCBlock)):
+      yield firstPair + i, DCBlock[i]
+
+# Dark correct mode 3 dark/exposure pairs one at a time as they come in, so that each exposure can
+# go downstream as soon as both halves of its pair exist.  rawimagepairs is anything that yields
+# (pairNumber, darkimage, exposureimage), like PythonTools_IO.IterateTEAMPairs.
+def DarkCorrectMode3Stream(rawimagepairs, dtype=np.int32):
+  for pairNumber, darkimage, exposureimage in rawimagepairs:
+    print "\tDark-correcting exposure", str(pairNumber + 1) + "..."
+    yield pairNumber, np.subtract(exposureimage, darkimage, dtype=dtype)
+
+# Subtract the median of each row of each ADC channel (the common-mode offset), leaving out pixels
+# within maskneighborhood of a hit (more than signalthreshold above a first-pass median).  Rows with
+# fewer than minpixels unmasked pixels are left alone.  Returns the image (float32) and the baselines.
+def CommonModeCorrect(dcimage, nadcchannels, signalthreshold, maskneighborhood=5, minpixels=16):
+  nPixelsY, nPixelsX = dcimage.shape
+  PixelsPerChannel = nPixelsX / nadcchannels
+  Image = np.asarray(dcimage, dtype=np.float32)
+  ChannelView = Image.reshape(nPixelsY, nadcchannels, PixelsPerChannel)
+  RoughBaselines = np.median(ChannelView, axis=2)
+  RoughImage = (ChannelView - RoughBaselines[:, :, np.newaxis]).reshape(nPixelsY, nPixelsX)
+  SignalMask = (filters.maximum_filter(RoughImage, maskneighborhood) > signalthreshold)
+  SortedValues = np.where(SignalMask, np.inf, Image).reshape(nPixelsY, nadcchannels, PixelsPerChannel)
+  SortedValues.sort(axis=2)
+  nUnmasked = PixelsPerChannel - SignalMask.reshape(nPixelsY, nadcchannels, PixelsPerChannel).sum(axis=2)
+  Rows, Channels = np.indices((nPixelsY, nadcchannels))
+  LowerMiddle = SortedValues[Rows, Channels, np.maximum(nUnmasked - 1, 0) / 2]
+  UpperMiddle = SortedValues[Rows, Channels, np.minimum(nUnmasked / 2, PixelsPerChannel - 1)]
+  Baselines = np.where(nUnmasked >= minpixels, 0.5 * (LowerMiddle + UpperMiddle), 0.).astype(np.float32)
+  CorrectedImage = ChannelView - Baselines[:, :, np.newaxis]
+  return CorrectedImage.reshape(nPixelsY, nPixelsX), Baselines
+
+# Common-mode correct a stream of (imageNumber, dcimage) pairs, like the ones that come out of the
+# dark correction streams above.
+def CommonModeCorrectStream(dcimagesource, nadcchannels, signalthreshold, maskneighborhood=5, minpixels=16):
+  for imageNumber, dcimage in dcimagesource:
+    CorrectedImage, Baselines = CommonModeCorrect(dcimage, nadcchannels, signalthreshold, maskneighborhood, minpixels)
+    yield imageNumber, CorrectedImage
+
+# Statistics for every labelled region of image at once.  labeledmask and nlabels are what
+# ndimage.label returns.  Only the labelled pixels get looked at, in one pass: the per-region sums
+# all come out of np.bincount, and the peaks out of one np.maximum.reduceat over the pixels sorted by
+# label.  Returns a dictionary of arrays, one entry per region:
+#   "CentroidY", "CentroidX": Centre of mass, weighted by the pixel values.
+#   "SeedY", "SeedX":         The whole pixel the centre of mass falls in, as integers.  This is the
+#                             pixel that the data quality cuts and the Sum(N) boxes are centred on.
+#   "nPixels":                How many pixels are in the region.
+#   "Integral":               Sum of the pixel values in the region.
+#   "Peak":                   Largest pixel value in the region.
+def RegionStats(image, labeledmask, nlabels):
+  image = np.asarray(image)
+  PixelIndecies = np.flatnonzero(labeledmask)
+  Labels = labeledmask.ravel()[PixelIndecies]
+  Values = image.ravel()[PixelIndecies].astype(float)
+  PixelYs, PixelXs = np.unravel_index(PixelIndecies, image.shape)
+  Stats = {}
+  Stats["nPixels"] = np.bincount(Labels, minlength=nlabels + 1)[1:]
+  Stats["Integral"] = np.bincount(Labels, weights=Values, minlength=nlabels + 1)[1:]
+  Stats["CentroidY"] = np.bincount(Labels, weights=Values * PixelYs, minlength=nlabels + 1)[1:] / Stats["Integral"]
+  Stats["CentroidX"] = np.bincount(Labels, weights=Values * PixelXs, minlength=nlabels + 1)[1:] / Stats["Integral"]
+  Stats["SeedY"] = np.floor(Stats["CentroidY"]).astype(int)
+  Stats["SeedX"] = np.floor(Stats["CentroidX"]).astype(int)
+  if(nlabels > 0):
+    LabelOrder = np.argsort(Labels, kind="mergesort")
+    RegionStarts = np.concatenate(([0], np.cumsum(Stats["nPixels"])[:-1]))
+    Stats["Peak"] = np.maximum.reduceat(image.ravel()[PixelIndecies][LabelOrder], RegionStarts)
+  else:
+    Stats["Peak"] = np.zeros(0, dtype=image.dtype)
+  return Stats
+
+# RegionStats, plus the shape of every region, again all at once: the charge weighted second moments
+# about the centroid ("Myy", "Mxx", "Mxy", in pixels squared), the elongation, and the bounding box
+# ("MinY", "MaxY", "MinX", "MaxX", inclusive).  The elongation is the square root of the ratio of the
+# long axis to the short axis variance, with the 1/12 pixel squared that a single pixel spreads over
+# added to both, so a one pixel (or perfectly round) region comes out as 1.  Pixel values should be
+# positive, i.e. labeledmask should come from a threshold above zero.
+def RegionShapes(image, labeledmask, nlabels):
+  image = np.asarray(image)
+  Stats = RegionStats(image, labeledmask, nlabels)
+  PixelIndecies = np.flatnonzero(labeledmask)
+  Labels = labeledmask.ravel()[PixelIndecies]
+  Values = image.ravel()[PixelIndecies].astype(float)
+  PixelYs, PixelXs = np.unravel_index(PixelIndecies, image.shape)
+  # Measure everything from each region's centroid to keep the sums small.
+  dY = PixelYs - Stats["CentroidY"][Labels - 1]
+  dX = PixelXs - Stats["CentroidX"][Labels - 1]
+  Stats["Myy"] = np.bincount(Labels, weights=Values * dY * dY, minlength=nlabels + 1)[1:] / Stats["Integral"]
+  Stats["Mxx"] = np.bincount(Labels, weights=Values * dX * dX, minlength=nlabels + 1)[1:] / Stats["Integral"]
+  Stats["Mxy"] = np.bincount(Labels, weights=Values * dY * dX, minlength=nlabels + 1)[1:] / Stats["Integral"]
+  HalfTrace = 0.5 * (Stats["Myy"] + Stats["Mxx"])
+  Spread = np.sqrt((0.5 * (Stats["Myy"] - Stats["Mxx"])) ** 2 + Stats["Mxy"] ** 2)
+  Stats["Elongation"] = np.sqrt((HalfTrace + Spread + (1. / 12.)) / np.maximum(HalfTrace - Spread + (1. / 12.), 1. / 12.))
+  if(nlabels > 0):
+    LabelOrder = np.argsort(Labels, kind="mergesort")
+    RegionStarts = np.concatenate(([0], np.cumsum(Stats["nPixels"])[:-1]))
+    Stats["MinY"] = np.minimum.reduceat(PixelYs[LabelOrder], RegionStarts)
+    Stats["MaxY"] = np.maximum.reduceat(PixelYs[LabelOrder], RegionStarts)
+    Stats["MinX"] = np.minimum.reduceat(PixelXs[LabelOrder], RegionStarts)
+    Stats["MaxX"] = np.maximum.reduceat(PixelXs[LabelOrder], RegionStarts)
+  else:
+    for name in ["MinY", "MaxY", "MinX", "MaxX"]:
+      Stats[name] = np.zeros(0, dtype=int)
+  return Stats
+
+# Label the connected (including diagonally) groups of pixels above threshold in dcimage, and work
+# out their RegionShapes.
+def FindPixelClusters(dcimage, threshold):
+  LabeledMask, nClusters = ndimage.label(dcimage > threshold, structure=np.ones((3, 3)))
+  return RegionShapes(dcimage, LabeledMask, nClusters)
+
+# Keep just the regions in a RegionStats dictionary where keep is True.
+def SelectRegions(regionstats, keep):
+  return dict((name, values[keep]) for name, values in regionstats.items())
+
+# Find the local maxima in dcimage that are above threshold, given the frame's maximum filtered
+# image (framemaxima).  Neighbouring local maximum pixels with the same value get lumped together
+# into one feature.  Returns the RegionStats of the features.
+def FindLocalMaxima(dcimage, framemaxima, threshold):
+  LocalMaxMask = (dcimage == framemaxima) & (dcimage > threshold)
+  LabeledMask, nFeatures = ndimage.label(LocalMaxMask)
+  return RegionStats(dcimage, LabeledMask, nFeatures)
+
+# Hit finder data quality cut number 1: flag the hits with seed pixels (seedy, seedx) that are within
+# edgeboundary pixels of the edge of an npixelsy x npixelsx image.
+def EdgeCutMask(seedy, seedx, npixelsy, npixelsx, edgeboundary=2):
+  EdgeHits = (seedy < edgeboundary) | (seedy >= (npixelsy - edgeboundary))
+  EdgeHits |= (seedx < edgeboundary) | (seedx >= (npixelsx - edgeboundary))
+  return EdgeHits
+
+# Hit finder data quality cut number 2: flag the hits with seed pixels (seedy, seedx) where some other
+# ADC channel is above noisethreshold in the same row, at the same column within its readout, which
+# means the hit is most likely correlated noise.  Rather than look at every other channel hit by
+# hit, the (row, column within readout) maximum and second maximum across all of the channels get
+# worked out once for the rows that have hits in them.  The other channels' maximum is then the
+# overall maximum, unless the hit's own channel holds it, in which case it's the second maximum.
+def NoiseCutMask(dcimage, seedy, seedx, nadcchannels, noisethreshold):
+  nPixelsY, nPixelsX = dcimage.shape
+  PixelsPerChannel = nPixelsX / nadcchannels
+  HitRows, RowIndex = np.unique(seedy, return_inverse=True)
+  ChannelValues = np.asarray(dcimage)[HitRows].reshape(len(HitRows), nadcchannels, PixelsPerChannel)
+  ChannelMax = ChannelValues.max(axis=1)
+  ChannelArgMax = ChannelValues.argmax(axis=1)
+  ChannelSecondMax = np.partition(ChannelValues, nadcchannels - 2, axis=1)[:, nadcchannels - 2]
+  Channel = seedx / PixelsPerChannel
+  Offset = seedx % PixelsPerChannel
+  OtherChannelMax = np.where(ChannelArgMax[RowIndex, Offset] == Channel, ChannelSecondMax[RowIndex, Offset], ChannelMax[RowIndex, Offset])
+  return OtherChannelMax > noisethreshold
+
+# The ways ReadTEAMData.py knows how to group the hits in a frame into clusters ("none" skips it).
+ClusterMethods = ["fof", "meanshift", "none"]
+
+# Friends-of-friends clustering of points (an (n, 2) array of (y, x) coordinates): any two points
+# within linkinglength of each other end up in the same cluster, along with all of their friends.
+# The pairs come from a KD-tree and the clusters are the connected components of the graph they
+# make, so the cost grows roughly linearly with the number of points instead of blowing up like
+# MeanShift does on busy frames.  Returns a cluster label (0, 1, ...) for every point, and the mean
+# (y, x) position of each cluster.
+def FriendsOfFriends(points, linkinglength):
+  points = np.asarray(points, dtype=float).reshape(-1, 2)
+  nPoints = len(points)
+  if(nPoints == 0): return np.zeros(0, dtype=int), np.zeros((0, 2))
+  Pairs = cKDTree(points).query_pairs(linkinglength, output_type="ndarray").reshape(-1, 2)
+  Links = sparse.coo_matrix((np.ones(len(Pairs)), (Pairs[:, 0], Pairs[:, 1])), shape=(nPoints, nPoints))
+  nClusters, Labels = connected_components(Links, directed=False)
+  nMembers = np.bincount(Labels, minlength=nClusters).astype(float)
+  ClusterCenters = np.column_stack((np.bincount(Labels, weights=points[:, 0], minlength=nClusters) / nMembers,
+                                    np.bincount(Labels, weights=points[:, 1], minlength=nClusters) / nMembers))
+  return Labels, ClusterCenters
+
+# The integral of values (the seed pixel value of each hit, say) and the number of hits in each of
+# nclusters clusters, given the cluster label of every hit.
+def ClusterSums(values, labels, nclusters):
+  ClusterIntegrals = np.bincount(labels, weights=np.asarray(values, dtype=float), minlength=nclusters)
+  ClusterSizes = np.bincount(labels, minlength=nclusters)
+  return ClusterIntegrals, ClusterSizes
+
+# Downsampled copies of an image for quick looks, as a dictionary keyed by (size, "Mean") and (size,
+# "Max"), where size is the number of rows at that level (e.g. 512, 256 and 128 for a 1024 x 1024
+# frame).  Each level is built from the one above it by averaging (and taking the maximum of) square
+# blocks of pixels, so the mean levels are float32 and the max levels keep the image's type.  Sizes
+# that don't divide the image evenly get skipped.
+def ImagePyramid(image, sizes):
+  Pyramid = {}
+  MeanLevel = np.asarray(image, dtype=np.float32)
+  MaxLevel = np.asarray(image)
+  for size in sorted(sizes, reverse=True):
+    nRows, nColumns = MeanLevel.shape
+    if((size > nRows) or (nRows % size != 0) or (nColumns % (nRows / size) != 0)): continue
+    Factor = nRows / size
+    if(Factor > 1):
+      MeanLevel = MeanLevel.reshape(size, Factor, nColumns / Factor, Factor).mean(axis=(1, 3))
+      MaxLevel = MaxLevel.reshape(size, Factor, nColumns / Factor, Factor).max(axis=(1, 3))
+    Pyramid[(size, "Mean")] = MeanLevel
+    Pyramid[(size, "Max")] = MaxLevel
+  return Pyramid
+
+# A summed-area table of image: SummedAreaTable[r, c] is the sum of image[:r, :c], so it has an extra
+# row and column of zeros up front.  Integer images get summed as 64 bit integers so the box sums
+# come out exact.
+def SummedAreaTable(image):
+  image = np.asarray(image)
+  if(image.dtype.kind in "biu"):
+    SumType = np.int64
+  else:
+    SumType = np.float64
+  nPixelsY, nPixelsX = image.shape
+  Table = np.zeros((nPixelsY + 1, nPixelsX + 1), dtype=SumType)
+  np.cumsum(np.cumsum(image, axis=0, dtype=SumType), axis=1, out=Table[1:, 1:])
+  return Table
+
+# Sum of the boxes [top:bottom, left:right] of the image behind summedareatable, for whole arrays of
+# box corners at once.
+def BoxSums(summedareatable, top, bottom, left, right):
+  return (summedareatable[bottom, right] - summedareatable[top, right] -
+          summedareatable[bottom, left] + summedareatable[top, left])
+
+# The Sum(N) of each hit at (seedy, seedx) for each box width (3 is Sum(9), 5 is Sum(25), ...), and
+# whether any pixel in the box is above sumnthreshold (a good cluster), as two dictionaries keyed by
+# box width.  Both come from summed-area tables of the frame, which can be passed in if they've
+# already been built.  Off-image pixels count as zeros.
+def SumNBoxValues(dcimage, seedy, seedx, boxwidths=[1, 3, 5], sumnthreshold=40., valuetable=None, abovethresholdtable=None):
+  dcimage = np.asarray(dcimage)
+  nPixelsY, nPixelsX = dcimage.shape
+  if(valuetable is None): valuetable = SummedAreaTable(dcimage)
+  if(abovethresholdtable is None): abovethresholdtable = SummedAreaTable(dcimage > sumnthreshold)
+  SumNValues = {}
+  GoodClusters = {}
+  for boxwidth in boxwidths:
+    if(boxwidth % 2 != 1):
+      raise ValueError("Sum(N) boxes need an odd width, not " + str(boxwidth) + ".")
+    if(boxwidth == 1):
+      # Sum(1) is just the pixel itself, so read it straight out of the image.
+      SumNValues[1] = dcimage[seedy, seedx]
+      GoodClusters[1] = (SumNValues[1] > sumnthreshold)
+      continue
+    HalfWidth = boxwidth / 2
+    Top = np.clip(seedy - HalfWidth, 0, nPixelsY)
+    Bottom = np.clip(seedy + HalfWidth + 1, 0, nPixelsY)
+    Left = np.clip(seedx - HalfWidth, 0, nPixelsX)
+    Right = np.clip(seedx + HalfWidth + 1, 0, nPixelsX)
+    SumNValues[boxwidth] = BoxSums(valuetable, Top, Bottom, Left, Right)
+    GoodClusters[boxwidth] = (BoxSums(abovethresholdtable, Top, Bottom, Left, Right) > 0)
+  return SumNValues, GoodClusters
+
+# Scan the hit finder over every combination of localmaxthresholds and sumnthresholds for one frame
+# in a single pass.  The maximum filtered image (framemaxima) and the summed-area tables get built
+# once and shared by every combination; only the labelling of the local maxima and the data quality
+# cuts get redone for each local max threshold (the noise cut follows it at half of it, just like
+# ReadTEAMData.py).  Returns the Sum(1), Sum(9) and Sum(25) spectra binned with
+# FixedWidthHistogram, as a (local max thresholds, Sum(N) thresholds, 3, bins) array, and the
+# number of hits (Sum(1)) and good Sum(9) and Sum(25) clusters, as a (local max thresholds, Sum(N)
+# thresholds, 3) array.
+def ThresholdScanFrame(dcimage, framemaxima, localmaxthresholds, sumnthresholds, nadcchannels, edgeboundary, xlo, xhi, xstep):
+  nPixelsY, nPixelsX = dcimage.shape
+  nBins = int(round((xhi - xlo) / xstep))
+  Spectra = np.zeros((len(localmaxthresholds), len(sumnthresholds), 3, nBins))
+  Counts = np.zeros((len(localmaxthresholds), len(sumnthresholds), 3), dtype=int)
+  ValueTable = SummedAreaTable(dcimage)
+  AboveThresholdTables = [SummedAreaTable(dcimage > sumnthreshold) for sumnthreshold in sumnthresholds]
+  for i, localmaxthreshold in enumerate(localmaxthresholds):
+    Hits = FindLocalMaxima(dcimage, framemaxima, localmaxthreshold)
+    Hits = SelectRegions(Hits, ~EdgeCutMask(Hits["SeedY"], Hits["SeedX"], nPixelsY, nPixelsX, edgeboundary))
+    Hits = SelectRegions(Hits, ~NoiseCutMask(dcimage, Hits["SeedY"], Hits["SeedX"], nadcchannels, 0.5 * localmaxthreshold))
+    for j, sumnthreshold in enumerate(sumnthresholds):
+      SumNValues, GoodClusters = SumNBoxValues(dcimage, Hits["SeedY"], Hits["SeedX"], [1, 3, 5], sumnthreshold, ValueTable, AboveThresholdTables[j])
+      AboveThreshold = (SumNValues[1] > localmaxthreshold)
+      Spectra[i, j, 0] = FixedWidthHistogram(SumNValues[1][AboveThreshold], xlo, xhi, xstep)
+      Spectra[i, j, 1] = FixedWidthHistogram(np.where(GoodClusters[3], SumNValues[3], 0.)[AboveThreshold], xlo, xhi, xstep)
+      Spectra[i, j, 2] = FixedWidthHistogram(np.where(GoodClusters[5], SumNValues[5], 0.)[AboveThreshold], xlo, xhi, xstep)
+      Counts[i, j] = [AboveThreshold.sum(), GoodClusters[3][AboveThreshold].sum(), GoodClusters[5][AboveThreshold].sum()]
+  return Spectra, Counts
+
+# One row per hit, for the hit tables that ReadTEAMData.py saves alongside the spectra.  Y and X are
+# the whole pixel the hit is in, CentroidY and CentroidX are where its local maximum is centred, and
+# SumNN/GoodNN are the raw box sums and good cluster flags from SumNBoxValues (so the Sum(N) spectra,
+# with or without different cuts, can be rebuilt from the table without going back to the frames).
+HitTableType = np.dtype([("Frame", np.int32), ("TimeStamp", np.int32), ("Y", np.int16), ("X", np.int16),
+                         ("CentroidY", np.float32), ("CentroidX", np.float32), ("Sum1", np.float32),
+                         ("Sum9", np.float32), ("Sum25", np.float32), ("Good9", np.bool_),
+                         ("Good25", np.bool_), ("ADCChannel", np.uint8)])
+
+# Pack the hits found in one frame (their RegionStats, and what SumNBoxValues made of them) into a
+# HitTableType array.
+def MakeHitTable(framenumber, timestamp, hits, sumnvalues, goodclusters, xpixelsperreadout):
+  HitTable = np.zeros(len(hits["SeedY"]), dtype=HitTableType)
+  HitTable["Frame"] = framenumber
+  HitTable["TimeStamp"] = timestamp
+  HitTable["Y"] = hits["SeedY"]
+  HitTable["X"] = hits["SeedX"]
+  HitTable["CentroidY"] = hits["CentroidY"]
+  HitTable["CentroidX"] = hits["CentroidX"]
+  HitTable["Sum1"] = sumnvalues[1]
+  HitTable["Sum9"] = sumnvalues[3]
+  HitTable["Sum25"] = sumnvalues[5]
+  HitTable["Good9"] = goodclusters[3]
+  HitTable["Good25"] = goodclusters[5]
+  HitTable["ADCChannel"] = hits["SeedX"] / xpixelsperreadout
+  return HitTable
+
+# One row per cluster of connected pixels above threshold (see FindPixelClusters), for the cluster
+# tables that ReadTEAMData.py saves alongside the hit tables.
+ClusterTableType = np.dtype([("Frame", np.int32), ("nPixels", np.int32), ("Charge", np.float32), ("Peak", np.float32),
+                             ("CentroidY", np.float32), ("CentroidX", np.float32), ("Myy", np.float32),
+                             ("Mxx", np.float32), ("Mxy", np.float32), ("Elongation", np.float32),
+                             ("MinY", np.int16), ("MaxY", np.int16), ("MinX", np.int16), ("MaxX", np.int16)])
+
+# Pack the pixel clusters found in one frame (their RegionShapes) into a ClusterTableType array.
+def MakeClusterTable(framenumber, clusters):
+  ClusterTable = np.zeros(len(clusters["nPixels"]), dtype=ClusterTableType)
+  ClusterTable["Frame"] = framenumber
+  ClusterTable["Charge"] = clusters["Integral"]
+  for name in ["nPixels", "Peak", "CentroidY", "CentroidX", "Myy", "Mxx", "Mxy", "Elongation", "MinY", "MaxY", "MinX", "MaxX"]:
+    ClusterTable[name] = clusters[name]
+  return ClusterTable
+
+# One row per cluster of hits that passed the cluster cuts in ReadTEAMData.py (the beam and
+# diffraction spots): its center, the sum of its hits' pixel values, and how many hits it has.
+HitClusterTableType = np.dtype([("Frame", np.int32), ("CenterY", np.float32), ("CenterX", np.float32),
+                                ("Integral", np.float32), ("nHits", np.int32)])
+
+# Pack the clusters of hits kept in one frame into a HitClusterTableType array.
+def MakeHitClusterTable(framenumber, centers, integrals, sizes):
+  HitClusterTable = np.zeros(len(integrals), dtype=HitClusterTableType)
+  HitClusterTable["Frame"] = framenumber
+  if(len(integrals) > 0):
+    HitClusterTable["CenterY"] = np.asarray(centers)[:, 0]
+    HitClusterTable["CenterX"] = np.asarray(centers)[:, 1]
+  HitClusterTable["Integral"] = integrals
+  HitClusterTable["nHits"] = sizes
+  return HitClusterTable
+
+# Histogram values into fixed-width bins from xlo to xhi, xstep wide, with np.bincount.  Since the bins
+# are all the same width, each value's bin is just (value - xlo) / xstep, rounded down, so there's
+# no searching through the bin edges.  Same conventions as np.histogram on the matching edges: values
+# outside [xlo, xhi] get dropped, and a value right on xhi goes in the last bin.
+def FixedWidthHistogram(values, xlo, xhi, xstep, weights=None):
+  nBins = int(round((xhi - xlo) / xstep))
+  values = np.asarray(values, dtype=float).ravel()
+  BinIndecies = np.floor((values - xlo) / xstep).astype(int)
+  BinIndecies[values == xhi] = nBins - 1
+  InRange = (values >= xlo) & (values <= xhi)
+  if(weights is not None): weights = np.asarray(weights, dtype=float).ravel()[InRange]
+  return np.bincount(BinIndecies[InRange], weights=weights, minlength=nBins).astype(float)
+
+# A fixed-width histogram that carries its own binning: nBins bins, xStep wide, from xLo to xHi, with
+# the bin contents (Values) and the sum of the squared weights in each bin (SumW2, which is just the
+# counts for an unweighted histogram) as float arrays.  Histograms with the same binning add up in
+# place with +=, so a global spectrum is one vectorized addition per file, and adding ones with
+# different binning raises a ValueError instead of quietly misaligning the bins.
+class Histogram1D(object):
+  def __init__(self, xlo, xhi, xstep, values=None, sumw2=None):
+    self.xLo = float(xlo)
+    self.xStep = float(xstep)
+    self.nBins = int(round((xhi - xlo) / xstep))
+    self.xHi = self.xLo + (self.nBins * self.xStep)
+    if(values is None): values = np.zeros(self.nBins)
+    self.Values = np.asarray(values, dtype=float)
+    if(sumw2 is None): sumw2 = self.Values.copy()
+    self.SumW2 = np.asarray(sumw2, dtype=float)
+    if((len(self.Values) != self.nBins) or (len(self.SumW2) != self.nBins)):
+      raise ValueError("Expected " + str(self.nBins) + " bin values from " + str(xlo) + " to " + str(xhi) + " in steps of " + str(xstep) + ".")
+
+  # Histogram some more values (see FixedWidthHistogram).
+  def Fill(self, values, weights=None):
+    self.Values += FixedWidthHistogram(values, self.xLo, self.xHi, self.xStep, weights)
+    if(weights is None):
+      self.SumW2 += FixedWidthHistogram(values, self.xLo, self.xHi, self.xStep)
+    else:
+      self.SumW2 += FixedWidthHistogram(values, self.xLo, self.xHi, self.xStep, np.square(weights))
+
+  def SameBinning(self, other):
+    return ((self.nBins == other.nBins) and np.isclose(self.xLo, other.xLo) and np.isclose(self.xStep, other.xStep))
+
+  def __iadd__(self, other):
+    if(not self.SameBinning(other)):
+      raise ValueError("Can't add a histogram with " + str(other.nBins) + " bins from " + str(other.xLo) + " to " + str(other.xHi) +
+                       " to one with " + str(self.nBins) + " bins from " + str(self.xLo) + " to " + str(self.xHi) + ".")
+    self.Values += other.Values
+    self.SumW2 += other.SumW2
+    return self
+
+  def __add__(self, other):
+    Sum = self.Copy()
+    Sum += other
+    return Sum
+
+  def Copy(self):
+    return Histogram1D(self.xLo, self.xHi, self.xStep, self.Values.copy(), self.SumW2.copy())
+
+  def BinEdges(self):
+    return self.xLo + (self.xStep * np.arange(self.nBins + 1))
+
+  def BinCenters(self):
+    return self.xLo + (self.xStep * (np.arange(self.nBins) + 0.5))
+
+  def Errors(self):
+    return np.sqrt(self.SumW2)
+
+  # Merge every ngroup neighbouring bins into one.  ngroup has to divide the number of bins evenly.
+  def Rebin(self, ngroup):
+    if(self.nBins % ngroup != 0):
+      raise ValueError("Can't merge " + str(self.nBins) + " bins in groups of " + str(ngroup) + ".")
+    return Histogram1D(self.xLo, self.xHi, ngroup * self.xStep, self.Values.reshape(-1, ngroup).sum(axis=1),
+                       self.SumW2.reshape(-1, ngroup).sum(axis=1))
+
+  # Just the bins from xlo to xhi, which have to land on bin edges.  The new histogram's contents are
+  # views into this one's, not copies.
+  def Slice(self, xlo, xhi):
+    FirstBin, LastBin = (int(round((x - self.xLo) / self.xStep)) for x in (xlo, xhi))
+    if((not np.isclose(self.xLo + (FirstBin * self.xStep), xlo)) or (not np.isclose(self.xLo + (LastBin * self.xStep), xhi)) or
+       (FirstBin < 0) or (LastBin > self.nBins) or (FirstBin >= LastBin)):
+      raise ValueError("Can't slice " + str(xlo) + " to " + str(xhi) + " out of " + str(self.nBins) + " bins from " + str(self.xLo) +
+                       " to " + str(self.xHi) + " in steps of " + str(self.xStep) + ".")
+    return Histogram1D(xlo, xhi, self.xStep, self.Values[FirstBin:LastBin], self.SumW2[FirstBin:LastBin])
+
+# Add up a bunch of histograms with the same binning.
+def SumHistograms(histograms):
+  Sum = None
+  for histogram in histograms:
+    if(Sum is None):
+      Sum = histogram.Copy()
+    else:
+      Sum += histogram
+  return Sum
+
+# The Sum(1), Sum(9) and Sum(25) values of the rows of a hit table (see HitTableType) that pass a set
+# of cuts: the central pixel has to be above minsum1, and the hit has to be in a frame from
+# firstframe to lastframe (lastframe < 0 means no upper limit).  With goodclustersonly set, Sum(9)
+# and Sum(25) boxes that didn't have any pixel above SumNThreshold count as zeros, which is how
+# ReadTEAMData.py fills its spectra.
+def SelectHitSumNValues(hits, minsum1, firstframe=0, lastframe=-1, goodclustersonly=True):
+  Selected = (hits["Sum1"] > minsum1) & (hits["Frame"] >= firstframe)
+  if(lastframe >= 0): Selected &= (hits["Frame"] <= lastframe)
+  hits = hits[Selected]
+  if(goodclustersonly):
+    return hits["Sum1"], np.where(hits["Good9"], hits["Sum9"], 0.), np.where(hits["Good25"], hits["Sum25"], 0.)
+  return hits["Sum1"], hits["Sum9"], hits["Sum25"]
 
 def StatusBar(current, total, steps):
   # Compute how far along we are...
@@ -74,8 +676,19 @@ def StatusBar(current, total, steps):
   # Now write the new status bar.
   sys.stdout.write(thisStatusBarString)
 
-def PlotHistogram(data, binedges, color, plottitle, xtitle, ytitle, plotfilepath):
-  HistBinValues = plt.hist(data, bins=binedges, facecolor=color, alpha=0.75)[0]
+# Histogram data and save a plot of it.  The bin values come from numpy, and get returned, so the
+# plotting is just drawing them.
+def PlotHistogram(data, binedges, color, plottitle, xtitle, ytitle, plotfilepath, weights=None):
+  HistBinValues = np.histogram(data, bins=binedges, weights=weights)[0].astype(float)
+  PlotHistogramValues(binedges, HistBinValues, color, plottitle, xtitle, ytitle, plotfilepath)
+  return HistBinValues
+
+# Save a plot of a histogram that has already been filled (by FixedWidthHistogram, say), with binvalues
+# being the contents of the bins between binedges.  The bins get drawn as a single filled step outline
+# rather than a bar per bin, which is a lot quicker to draw and save.
+def PlotHistogramValues(binedges, binvalues, color, plottitle, xtitle, ytitle, plotfilepath):
+  StepValues = np.append(binvalues, binvalues[-1])
+  plt.fill_between(binedges, StepValues, step='post', facecolor=color, edgecolor=color, alpha=0.75)
   plt.xlabel(xtitle)
   plt.ylabel(ytitle)
   plt.title(plottitle)
@@ -86,4 +699,90 @@ def PlotHistogram(data, binedges, color, plottitle, xtitle, ytitle, plotfilepath
     os.system("rm " + plotfilepath)
   plt.savefig(plotfilepath)
   plt.clf()
-  return HistBinValues
+
+# How ReadTEAMData.py handles its plots: "all" draws them as it goes, "deferred" skips them but saves
+# the dark corrected frames to the hdf5 file so that RenderTEAMData.py can draw them later, and
+# "none" skips them altogether.
+PlotModes = ["all", "deferred", "none"]
+
+# Turn (y, x) pixel coordinates into the display (x, y) coordinates of an image plotted over extent,
+# putting each point in the middle of its pixel.
+def DisplayCoordinates(coords, extent, imageshape):
+  coords = np.asarray(coords, dtype=float).reshape(-1, 2)
+  lPixelX = (extent[1] - extent[0]) / float(imageshape[1])
+  lPixelY = (extent[3] - extent[2]) / float(imageshape[0])
+  return extent[0] + (coords[:, 1] + 0.5) * lPixelX, extent[2] + (coords[:, 0] + 0.5) * lPixelY
+
+# Plot a dark corrected image with a colorbar and save it to plotfilepath, then mark the hits at
+# hitcoords ((y, x) pixel coordinates) on it and save that to annotatedplotfilepath.
+def PlotDCImage(dcimage, extent, plottitle, xtitle, ytitle, plotfilepath, annotatedplotfilepath, hitcoords):
+  plt.imshow(dcimage, alpha=0.75, aspect='auto', origin='lower', extent=extent, interpolation='none')
+  plt.colorbar()
+  plt.xlabel(xtitle)
+  plt.ylabel(ytitle)
+  plt.title(plottitle)
+  plt.grid(True)
+  if os.path.exists(plotfilepath):
+    print "Deleting old version of", plotfilepath
+    os.system("rm " + plotfilepath)
+  plt.savefig(plotfilepath)
+  HitDisplayX, HitDisplayY = DisplayCoordinates(hitcoords, extent, dcimage.shape)
+  plt.plot(HitDisplayX, HitDisplayY, 'ro')
+  plt.title("Found " + str(len(HitDisplayX)) + " Local Maxima")
+  if os.path.exists(annotatedplotfilepath):
+    print "Deleting old version of", annotatedplotfilepath
+    os.system("rm " + annotatedplotfilepath)
+  plt.savefig(annotatedplotfilepath)
+  plt.clf()
+
+# Plot a dark corrected image with the centers of the clusters that passed the cuts ((y, x) pixel
+# coordinates) marked on it in different colors, and save it to plotfilepath.
+def PlotClustersImage(dcimage, extent, xtitle, ytitle, plotfilepath, clustercenters):
+  plt.imshow(dcimage, alpha=0.75, aspect='auto', origin='lower', interpolation='none', extent=extent)
+  plt.colorbar()
+  plt.xlabel(xtitle)
+  plt.ylabel(ytitle)
+  plt.grid(True)
+  ClusterDisplayX, ClusterDisplayY = DisplayCoordinates(clustercenters, extent, dcimage.shape)
+  for displayx, displayy, col in zip(ClusterDisplayX, ClusterDisplayY, cycle('bgrcmyk')):
+    plt.plot(displayx, displayy, 'o', markerfacecolor=col, markeredgecolor='k', markersize=14)
+  plt.title("Found " + str(len(ClusterDisplayX)) + " Clusters")
+  plt.savefig(plotfilepath)
+  plt.clf()
+
+# Plot a single image with a colorbar and save it to plotfilepath.
+def PlotImage(image, extent, plottitle, xtitle, ytitle, plotfilepath):
+  plt.imshow(image, alpha=0.75, aspect='auto', origin='lower', extent=extent, interpolation='none')
+  plt.colorbar()
+  plt.xlabel(xtitle)
+  plt.ylabel(ytitle)
+  plt.title(plottitle)
+  plt.grid(True)
+  if os.path.exists(plotfilepath):
+    print "Deleting old version of", plotfilepath
+    os.system("rm " + plotfilepath)
+  plt.savefig(plotfilepath)
+  plt.clf()
+
+# Update a dictionary of run options from a list of "Name=Value" command line arguments.  Each value
+# is converted to the type of the default that's already in the dictionary.  Options with a list
+# as their default take a comma separated list of numbers (e.g. "Name=60,80,100").
+def ParseRunOptions(arguments, runoptions):
+  for argument in arguments:
+    if(argument.count("=") != 1):
+      raise ValueError("Run options need to look like Name=Value, not \'" + argument + "\'.")
+    Name, Value = argument.split("=")
+    if(Name not in runoptions):
+      raise ValueError("Unknown run option \'" + Name + "\'.  Known options are: " + ", ".join(sorted(runoptions.keys())) + ".")
+    Default = runoptions[Name]
+    if(isinstance(Default, bool)):
+      if(Value.lower() not in ["1", "0", "true", "false", "yes", "no"]):
+        raise ValueError("Run option \'" + Name + "\' needs to be true or false, not \'" + Value + "\'.")
+      runoptions[Name] = Value.lower() in ["1", "true", "yes"]
+    elif(isinstance(Default, list)):
+      ItemType = float
+      if(len(Default) > 0): ItemType = type(Default[0])
+      runoptions[Name] = [ItemType(item) for item in Value.split(",") if item != ""]
+    else:
+      runoptions[Name] = type(Default)(Value)
+  return runoptions
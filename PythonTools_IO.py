@@ -0,0 +1,524 @@
+#!/usr/bin/python
+
+###################################################################################################
+# Support functions for reading and decoding the binary .dat files written by the TEAM detector.  #
+###################################################################################################
+
+import os
+import time
+import struct
+import hashlib
+import numpy as np
+import h5py
+import PythonTools
+
+# Header information:
+HeaderLength = 9#32 bit integer words
+HeaderWordLength = 4#The header words are all 4 bytes/32 bits
+HeaderSize = HeaderLength * HeaderWordLength#[bytes]
+# First word is a little-endian, unsigned long, the rest are little-endian, signed longs.
+HeaderFormatCode = "<L" + str(HeaderLength - 1) + "l"
+# Image information
+PixelWordLength = 2#The pixels are 16 bit/2 byte words
+PixelDataType = np.dtype("<u2")#Little-endian, unsigned short, same as the old "<H" struct code
+# Sensor readout geometries we know about, as (nPixelsY, nPixelsX, nADCchannels).  The first one
+# that splits the file into a whole number of frames is the one we go with.
+KnownGeometries = [(1024, 1024, 16)]
+# Header words that go into the key a stored dark image gets filed under.  Nothing in here says which
+# of the header words are readout settings and which are counters or time stamps (which would change
+# from file to file and keep the library from ever finding a match), so by default none of them are
+# used, and darks only get matched on the geometry, the dark estimator and the time window.
+DarkKeyHeaderWords = []
+
+# Decode the 9 header words at the start of a .dat file in one go.
+def ReadTEAMHeader(thisfile):
+  HeaderBytes = thisfile.read(HeaderLength * HeaderWordLength)
+  return list(struct.unpack(HeaderFormatCode, HeaderBytes))
+
+# Decode nimages frames of npixelsy x npixelsx pixels with a single bulk little-endian read instead
+# of one struct.unpack call per pixel.  Reading starts wherever the file pointer currently is, so
+# call ReadTEAMHeader first.  Returns a (nimages, npixelsy, npixelsx) array of unsigned 16 bit ints.
+def ReadTEAMImages(thisfile, nimages, npixelsy, npixelsx):
+  nPixels = nimages * npixelsy * npixelsx
+  Images = np.fromfile(thisfile, dtype=PixelDataType, count=nPixels)
+  if(Images.size != nPixels):
+    raise IOError("Expected " + str(nPixels) + " pixels in " + thisfile.name + ", but only found " + str(Images.size) + ".")
+  return Images.reshape(nimages, npixelsy, npixelsx)
+
+# Decode the header of a .dat file into a dictionary of metadata, and work out the number of frames
+# and their geometry from the header and the size of the file.  Files that don't hold a whole number
+# of frames (or don't hold nimages of them, if we were told how many to expect) get rejected with
+# an IOError here, before anybody spends any time decoding them.  Set partial to True for a file
+# that is still being written: then only the whole frames that have landed so far are counted.
+def ReadTEAMFileInfo(filepath, nimages=None, geometry=None, partial=False):
+  FileSize = os.path.getsize(filepath)
+  if(FileSize < HeaderSize):
+    raise IOError(filepath + " is only " + str(FileSize) + " bytes long, which is too short to hold the " + str(HeaderSize) + " byte header.")
+  thisFile = open(filepath, "rb")
+  HeaderWords = ReadTEAMHeader(thisFile)
+  thisFile.close()
+  PayloadSize = FileSize - HeaderSize
+  Geometries = KnownGeometries
+  if(geometry is not None): Geometries = [geometry]
+  for npixelsy, npixelsx, nadcchannels in Geometries:
+    ImageSize = npixelsy * npixelsx * PixelWordLength
+    if(partial or ((PayloadSize > 0) and (PayloadSize % ImageSize == 0))): break
+  else:
+    # Nothing fits, so report the problem in terms of the first geometry on the list.
+    npixelsy, npixelsx, nadcchannels = Geometries[0]
+    ImageSize = npixelsy * npixelsx * PixelWordLength
+    raise IOError(filepath + " holds " + str(PayloadSize / ImageSize) + " whole " + str(npixelsy) + "x" + str(npixelsx) +
+                  " frames plus " + str(PayloadSize % ImageSize) + " extra bytes.  It looks truncated or corrupt.")
+  nImages = PayloadSize / ImageSize
+  if((nimages is not None) and partial): nImages = min(nImages, nimages)
+  if((nimages is not None) and (nImages < nimages) and not partial):
+    raise IOError(filepath + " only holds " + str(nImages) + " frames, but " + str(nimages) + " were expected.  It looks truncated.")
+  if((nimages is not None) and (nImages > nimages)):
+    raise IOError(filepath + " holds " + str(nImages) + " frames, but only " + str(nimages) + " were expected.  It looks oversized.")
+  FileInfo = {}
+  FileInfo["FilePath"] = filepath
+  FileInfo["FileSize"] = FileSize
+  FileInfo["ModificationTime"] = os.path.getmtime(filepath)
+  FileInfo["HeaderWords"] = HeaderWords
+  FileInfo["nImages"] = nImages
+  FileInfo["nPixelsY"] = npixelsy
+  FileInfo["nPixelsX"] = npixelsx
+  FileInfo["nADCchannels"] = nadcchannels
+  FileInfo["xPixelsPerReadout"] = npixelsx / nadcchannels
+  FileInfo["ImageSize"] = ImageSize
+  return FileInfo
+
+# Wait for a file that the acquisition system is about to start writing to show up with its whole
+# header.  Returns False if that doesn't happen within timeout seconds.
+def WaitForTEAMFile(filepath, pollinterval=0.5, timeout=10.):
+  StartTime = time.time()
+  while((not os.path.exists(filepath)) or (os.path.getsize(filepath) < HeaderSize)):
+    if(time.time() - StartTime > timeout): return False
+    time.sleep(pollinterval)
+  return True
+
+# A TEAM detector .dat file, memory mapped so that the frames are only pulled off of the disk when
+# something actually looks at them.  Indexing it (aTEAMFile[i], aTEAMFile[i:j]) returns zero-copy
+# uint16 views of the frames straight out of the page cache, so nothing gets decoded up front.  The
+# header, frame count and geometry come from ReadTEAMFileInfo, so bad files never get mapped.  With
+# follow set, the file may still be growing: only the whole frames written so far are mapped, and
+# Refresh picks up any new ones.
+class TEAMFile(object):
+  def __init__(self, filepath, nimages=None, geometry=None, follow=False):
+    self.FilePath = filepath
+    self.Follow = follow
+    self.nImagesExpected = nimages
+    self.Info = ReadTEAMFileInfo(filepath, nimages, geometry, follow)
+    self.HeaderWords = self.Info["HeaderWords"]
+    self.nPixelsY = self.Info["nPixelsY"]
+    self.nPixelsX = self.Info["nPixelsX"]
+    self.nADCchannels = self.Info["nADCchannels"]
+    self.xPixelsPerReadout = self.Info["xPixelsPerReadout"]
+    self.nImages = 0
+    self.Images = None
+    self.MapImages(self.Info["nImages"])
+
+  def MapImages(self, nimages):
+    self.nImages = nimages
+    if(nimages == 0):
+      # There's nothing to map yet, but keep the shape right for anybody who looks.
+      self.Images = np.zeros((0, self.nPixelsY, self.nPixelsX), dtype=PixelDataType)
+    else:
+      self.Images = np.memmap(self.FilePath, dtype=PixelDataType, mode="r", offset=HeaderSize,
+                              shape=(nimages, self.nPixelsY, self.nPixelsX))
+
+  # Check how much of a growing file has been written, and map any frames that have been completed
+  # since the last look.  Views handed out from the old map stay valid.  Returns the number of new
+  # frames.
+  def Refresh(self):
+    nImages = (os.path.getsize(self.FilePath) - HeaderSize) / self.Info["ImageSize"]
+    if(self.nImagesExpected is not None): nImages = min(nImages, self.nImagesExpected)
+    nNewImages = nImages - self.nImages
+    if(nNewImages > 0): self.MapImages(nImages)
+    return nNewImages
+
+  def __len__(self):
+    return self.nImages
+
+  def __getitem__(self, index):
+    return self.Images[index]
+
+  def __iter__(self):
+    for imageNumber in range(self.nImages):
+      yield self.Images[imageNumber]
+
+  # The time stamp is stored in the second pixel of the first row of each frame.
+  def GetTimeStamp(self, imagenumber):
+    return int(self.Images[imagenumber, 0, 1])
+
+  # Drop our reference to the memory map.  Views that were handed out stay valid until they go away.
+  def Close(self):
+    self.Images = None
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exctype, excvalue, traceback):
+    self.Close()
+
+# Step over the frames in a TEAMFile, yielding (imageNumber, image) for each one.  With follow set,
+# keep polling the file while it is being written and hand out each frame as soon as all of it has
+# landed on the disk.  Following stops once we have nImagesExpected frames (if the TEAMFile was told
+# how many to expect) or once the file hasn't grown for timeout seconds.
+def IterateTEAMImages(teamfile, follow=False, pollinterval=0.5, timeout=10.):
+  imageNumber = 0
+  LastFileSize = os.path.getsize(teamfile.FilePath)
+  LastGrowthTime = time.time()
+  while(True):
+    while(imageNumber < len(teamfile)):
+      yield imageNumber, teamfile[imageNumber]
+      imageNumber += 1
+    if(not follow): break
+    if((teamfile.nImagesExpected is not None) and (imageNumber >= teamfile.nImagesExpected)): break
+    FileSize = os.path.getsize(teamfile.FilePath)
+    if(FileSize != LastFileSize):
+      LastFileSize = FileSize
+      LastGrowthTime = time.time()
+    elif(time.time() - LastGrowthTime > timeout):
+      break
+    if(teamfile.Refresh() == 0): time.sleep(pollinterval)
+  if(follow and ((LastFileSize - HeaderSize) % teamfile.Info["ImageSize"] != 0)):
+    print "\t" + teamfile.FilePath + " stopped growing part of the way through frame", str(imageNumber) + ".  Ignoring the partial frame."
+
+# Step over the dark/exposure pairs of a mode 3 TEAMFile, yielding (pairNumber, darkimage,
+# exposureimage) as soon as both halves of each pair are available.
+def IterateTEAMPairs(teamfile, follow=False, pollinterval=0.5, timeout=10.):
+  for imageNumber, image in IterateTEAMImages(teamfile, follow, pollinterval, timeout):
+    if(imageNumber % 2 == 0):
+      DarkImage = image
+    else:
+      yield imageNumber / 2, DarkImage, image
+
+# How the tables and image stacks in the hdf5 output get compressed: "gzip" makes the smallest files,
+# "lzf" (which comes with h5py) is a few times faster to write and read back for files that are
+# somewhat bigger, and "none" doesn't compress them at all.
+Compressors = ["gzip", "lzf", "none"]
+
+# The create_dataset keyword arguments for one of the Compressors.
+def CompressionOptions(compressor):
+  if(compressor not in Compressors):
+    raise ValueError("The compressor needs to be one of " + str(Compressors) + ", not '" + str(compressor) + "'.")
+  if(compressor == "none"):
+    return {}
+  return {"compression": compressor, "shuffle": True}
+
+# The type an image gets stored as to keep the hdf5 output compact: float32 for floating point
+# images, int16 for signed (or wider than 16 bit) integer images, and anything else as is.
+def CompactType(dtype):
+  dtype = np.dtype(dtype)
+  if(dtype.kind == "f"):
+    return np.dtype(np.float32)
+  if((dtype.kind == "i") or ((dtype.kind == "u") and (dtype.itemsize > 2))):
+    return np.dtype(np.int16)
+  return dtype
+
+# image converted to its CompactType.  Integer values outside of the int16 range get clipped to it,
+# rather than wrapping around.
+def CompactImage(image):
+  image = np.asarray(image)
+  CompactDtype = CompactType(image.dtype)
+  if(CompactDtype == image.dtype):
+    return image
+  if(CompactDtype.kind == "i"):
+    Limits = np.iinfo(CompactDtype)
+    return np.clip(image, Limits.min, Limits.max).astype(CompactDtype)
+  return image.astype(CompactDtype)
+
+# Start an empty, extendable table of rows of type dtype (a structured numpy type, like
+# PythonTools.HitTableType) in an open hdf5 file.  It's stored in chunks of chunkrows rows,
+# compressed with compressor (see Compressors), and any keyword arguments get saved as attributes of
+# the table (the thresholds that went into it, say).
+def CreateTable(outputfile, name, dtype, chunkrows=4096, compressor="gzip", **attributes):
+  Table = outputfile.create_dataset(name, shape=(0,), maxshape=(None,), dtype=dtype,
+                                    chunks=(chunkrows,), **CompressionOptions(compressor))
+  for attributename, value in attributes.items():
+    Table.attrs[attributename] = value
+  return Table
+
+# Start an empty hit table (see PythonTools.HitTableType).
+def CreateHitTable(outputfile, name="HitTable", chunkrows=4096, compressor="gzip", **attributes):
+  return CreateTable(outputfile, name, PythonTools.HitTableType, chunkrows, compressor, **attributes)
+
+# Start an empty pixel cluster table (see PythonTools.ClusterTableType).
+def CreateClusterTable(outputfile, name="ClusterTable", chunkrows=4096, compressor="gzip", **attributes):
+  return CreateTable(outputfile, name, PythonTools.ClusterTableType, chunkrows, compressor, **attributes)
+
+# Start an empty, extendable stack of images of imageshape in an open hdf5 file, a single
+# (nimages, ...) dataset stored chunkimages images per chunk and compressed with compressor, so any
+# image in it can be read back in one go.  Any keyword arguments get saved as attributes.
+def CreateImageStack(outputfile, name, imageshape, dtype=np.float32, chunkimages=1, compressor="gzip", **attributes):
+  ImageStack = outputfile.create_dataset(name, shape=(0,) + tuple(imageshape), maxshape=(None,) + tuple(imageshape), dtype=dtype,
+                                         chunks=(chunkimages,) + tuple(imageshape), **CompressionOptions(compressor))
+  for attributename, value in attributes.items():
+    ImageStack.attrs[attributename] = value
+  return ImageStack
+
+# The hdf5 path of one level of an image pyramid (see PythonTools.ImagePyramid) of a kind of image
+# ("Raw", "DC" or "Dark"), e.g. "Pyramid/Raw/256/Mean".
+def PyramidPath(kind, size, statistic):
+  return "Pyramid/" + kind + "/" + str(size) + "/" + statistic
+
+# Save an image pyramid of a single image (the dark image, say) to an open hdf5 file, each level as
+# its CompactType.
+def SavePyramid(outputfile, kind, pyramid, compressor="gzip"):
+  for (size, statistic), level in pyramid.items():
+    outputfile.create_dataset(PyramidPath(kind, size, statistic), data=CompactImage(level), **CompressionOptions(compressor))
+
+# Append the image pyramid of the next frame to the stacks of them in an open hdf5 file, a stack per
+# level (of its CompactType), made with CreateImageStack the first time around.
+def AppendToPyramid(outputfile, kind, pyramid, compressor="gzip"):
+  for (size, statistic), level in pyramid.items():
+    level = CompactImage(level)
+    if(PyramidPath(kind, size, statistic) not in outputfile):
+      CreateImageStack(outputfile, PyramidPath(kind, size, statistic), level.shape, level.dtype, compressor=compressor)
+    AppendToTable(outputfile[PyramidPath(kind, size, statistic)], level[np.newaxis])
+
+# Each frame's Sum(N) spectra (for N = "01", "09" or "25") go in a single (nframes, nbins) dataset,
+# a row per frame, and the time stamps of those frames in another.
+def SpectraPath(sumn):
+  return "Sum" + sumn + "HistoVals"
+SpectraTimeStampsPath = "SumNHistoTimeStamps"
+
+# Start the (empty) stacks of each frame's Sum(N) spectra, binned like histogram (a
+# PythonTools.Histogram1D, whose binning gets saved with them), and of their time stamps.
+def CreateSpectraStacks(outputfile, histogram, sumns=("01", "09", "25"), chunkrows=64, compressor="gzip"):
+  for sumn in sumns:
+    CreateImageStack(outputfile, SpectraPath(sumn), (histogram.nBins,), np.float32, chunkrows, compressor,
+                     xLo=histogram.xLo, xHi=histogram.xHi, xStep=histogram.xStep)
+  CreateImageStack(outputfile, SpectraTimeStampsPath, (), np.int64, 1024, compressor)
+
+# Cut the stacks from CreateSpectraStacks down to the spectra of their first nframes frames, and
+# return how many are left.
+def TrimSpectraStacks(outputfile, nframes, sumns=("01", "09", "25")):
+  for path in [SpectraPath(sumn) for sumn in sumns] + [SpectraTimeStampsPath]:
+    if(len(outputfile[path]) > nframes): outputfile[path].resize(nframes, axis=0)
+  return len(outputfile[SpectraTimeStampsPath])
+
+# The number of frames with their own spectra in an open hdf5 file from ReadTEAMData.py, either in
+# the stacks from CreateSpectraStacks or, in older files, as a dataset per frame ("Sum01HistoVals_0",
+# "Sum01HistoVals_1", ...).
+def nSavedSpectra(inputfile):
+  if(SpectraPath("01") in inputfile):
+    return len(inputfile[SpectraPath("01")])
+  nSpectra = 0
+  while((SpectraPath("01") + "_" + str(nSpectra)) in inputfile):
+    nSpectra += 1
+  return nSpectra
+
+# A frame's Sum(N) spectrum and the time stamp of that frame, out of an open hdf5 file from
+# ReadTEAMData.py (old or new layout, see nSavedSpectra).  The oldest files didn't save the time
+# stamps, so that comes back as None for them.
+def LoadSpectrum(inputfile, sumn, framenumber):
+  if(SpectraPath(sumn) in inputfile):
+    return inputfile[SpectraPath(sumn)][framenumber], inputfile[SpectraTimeStampsPath][framenumber]
+  SpectrumDataset = inputfile[SpectraPath(sumn) + "_" + str(framenumber)]
+  return SpectrumDataset[:], SpectrumDataset.attrs.get("TimeStamp")
+
+# Tack rows onto the end of a table made by CreateTable (or images onto a stack made by
+# CreateImageStack).
+def AppendToTable(table, rows):
+  if(len(rows) == 0): return
+  nRows = len(table)
+  table.resize((nRows + len(rows),) + table.shape[1:])
+  table[nRows:] = rows
+
+# The path of the hdf5 file that ReadTEAMData.py makes for a .dat file.
+def OutputFilePath(datfilepath):
+  return datfilepath.replace(".dat", "") + "/" + datfilepath.split("/")[-1].replace(".dat", ".hdf5")
+
+# Step through the hit table in an hdf5 file blockrows rows at a time, so that even a huge table
+# never has to be read in all at once.
+def IterateHitTable(filepath, name="HitTable", blockrows=1048576):
+  InputFile = h5py.File(filepath, "r")
+  HitTable = InputFile[name]
+  for firstRow in range(0, len(HitTable), blockrows):
+    yield HitTable[firstRow:firstRow + blockrows]
+  InputFile.close()
+
+# Rebuild the Sum(1), Sum(9) and Sum(25) spectra of one file from its hit table, binned like binning
+# (an empty PythonTools.Histogram1D) and with whatever cuts we like (see
+# PythonTools.SelectHitSumNValues).  Everything comes in as a single tuple so that this can be handed
+# straight to a multiprocessing pool.  Returns the file path, the three spectra (as Histogram1Ds) and
+# the number of hits that went into them, or None for the spectra if the file doesn't have a hit
+# table.
+def ReHistogramHitTable(arguments):
+  filepath, binning, minsum1, firstframe, lastframe, goodclustersonly = arguments
+  Spectra = [binning.Copy(), binning.Copy(), binning.Copy()]
+  nHits = 0
+  try:
+    for hits in IterateHitTable(filepath):
+      SumNValues = PythonTools.SelectHitSumNValues(hits, minsum1, firstframe, lastframe, goodclustersonly)
+      for spectrum, values in zip(Spectra, SumNValues):
+        spectrum.Fill(values)
+      nHits += len(SumNValues[0])
+  except (IOError, KeyError):
+    return filepath, None, 0
+  return filepath, Spectra, nHits
+
+# Save a PythonTools.Histogram1D to an open hdf5 file as a dataset of the bin contents called name,
+# with its binning as attributes, and the sums of the squared weights next to it as name + "_SumW2".
+def SaveHistogram(outputfile, name, histogram):
+  Dataset = outputfile.create_dataset(name, data=histogram.Values)
+  Dataset.attrs["xLo"] = histogram.xLo
+  Dataset.attrs["xHi"] = histogram.xHi
+  Dataset.attrs["xStep"] = histogram.xStep
+  outputfile.create_dataset(name + "_SumW2", data=histogram.SumW2)
+  return Dataset
+
+# Read a histogram saved by SaveHistogram back in, straight into the new histogram's arrays.  For
+# histograms saved without their binning (or without the sums of squared weights), like the Sum(N)
+# spectra in older ReadTEAMData.py output, the binning comes from the [xLo, xHi, xStep] dataset
+# called xaxisname, and the contents are taken to be plain counts.
+def LoadHistogram(inputfile, name, xaxisname="xAxisParams"):
+  Dataset = inputfile[name]
+  if("xStep" in Dataset.attrs):
+    xLo, xHi, xStep = Dataset.attrs["xLo"], Dataset.attrs["xHi"], Dataset.attrs["xStep"]
+  else:
+    xLo, xHi, xStep = inputfile[xaxisname][:3]
+  Histogram = PythonTools.Histogram1D(xLo, xHi, xStep)
+  Dataset.read_direct(Histogram.Values)
+  if((name + "_SumW2") in inputfile):
+    inputfile[name + "_SumW2"].read_direct(Histogram.SumW2)
+  else:
+    Histogram.SumW2[:] = Histogram.Values
+  return Histogram
+
+# Save a PythonTools.RunningDarkModel to a small, compressed hdf5 file so that the next file in a run
+# can pick up where this one left off.  The file gets written under a temporary name and then moved
+# into place, so a crash part of the way through never leaves a half-written model behind.
+def SaveDarkModel(darkmodel, filepath):
+  TempFilePath = filepath + ".tmp"
+  ModelFile = h5py.File(TempFilePath, "w")
+  ModelFile.create_dataset("DarkImage", data=darkmodel.DarkImage, compression="gzip", shuffle=True)
+  ModelFile.create_dataset("SpreadImage", data=darkmodel.SpreadImage, compression="gzip", shuffle=True)
+  ModelFile.attrs["Method"] = darkmodel.Method
+  ModelFile.attrs["Quantile"] = darkmodel.Quantile
+  ModelFile.attrs["Rate"] = darkmodel.Rate
+  ModelFile.attrs["nSigma"] = darkmodel.nSigma
+  ModelFile.attrs["nImages"] = darkmodel.nImages
+  ModelFile.close()
+  os.rename(TempFilePath, filepath)
+
+# Load a PythonTools.RunningDarkModel saved by SaveDarkModel.
+def LoadDarkModel(filepath):
+  ModelFile = h5py.File(filepath, "r")
+  DarkModel = PythonTools.RunningDarkModel(ModelFile["DarkImage"][...], ModelFile["SpreadImage"][...],
+                                           str(ModelFile.attrs["Method"]), float(ModelFile.attrs["Quantile"]),
+                                           float(ModelFile.attrs["Rate"]), float(ModelFile.attrs["nSigma"]),
+                                           int(ModelFile.attrs["nImages"]))
+  ModelFile.close()
+  return DarkModel
+
+# A directory of mode 2 dark images that have already been worked out, so that files taken with the
+# same detector settings at around the same time can share one dark image instead of each building
+# their own.  Every dark is filed under a key made from the readout geometry, the header words listed
+# in keyheaderwords (see DarkKeyHeaderWords) and how the dark was estimated, along with the time its
+# file was written.  A lookup only matches darks with the same key from files written within window
+# seconds of this one (the closest one in time wins).  Each dark lives in its own small, compressed
+# hdf5 file named Dark_<key hash>_<time>.hdf5, and the file's modification time records when it was
+# last used: once there are more than maxentries darks, the least recently used ones get deleted.
+# Only the index of the library is kept in memory; ReadTEAMData.py runs once per file, so the darks
+# themselves always get read back from the disk.
+class DarkLibrary(object):
+  def __init__(self, librarydir, window=3600., maxentries=100, keyheaderwords=DarkKeyHeaderWords):
+    for word in keyheaderwords:
+      if((word < 0) or (word >= HeaderLength)):
+        raise ValueError("The header only has words 0 to " + str(HeaderLength - 1) + ", so it can't key the dark library on word " + str(word) + ".")
+    self.LibraryDir = librarydir
+    self.Window = window
+    self.MaxEntries = maxentries
+    self.KeyHeaderWords = [int(word) for word in keyheaderwords]
+    if(not os.path.isdir(librarydir)): os.makedirs(librarydir)
+    self.Entries = {}
+    self.ScanLibrary()
+
+  # Rebuild the in-memory index, {file name: (key hash, time)}, from the library directory.
+  def ScanLibrary(self):
+    self.Entries = {}
+    for filename in os.listdir(self.LibraryDir):
+      Fields = filename.replace(".hdf5", "").split("_")
+      if(filename.endswith(".hdf5") and (len(Fields) == 3) and (Fields[0] == "Dark")):
+        self.Entries[filename] = (Fields[1], int(Fields[2]))
+
+  # The key for the dark image of a TEAMFile, given a description of how the dark is estimated
+  # (see PythonTools.DescribeDarkEstimator).
+  def MakeKey(self, teamfile, darkdescription):
+    Key = str(teamfile.nPixelsY) + "x" + str(teamfile.nPixelsX) + "x" + str(teamfile.nADCchannels)
+    Key += ";" + ",".join([str(teamfile.HeaderWords[i]) for i in self.KeyHeaderWords])
+    return Key + ";" + darkdescription
+
+  def HashKey(self, key):
+    return hashlib.md5(key).hexdigest()[:16]
+
+  # The file name of the stored dark that best matches key and time, or None if there isn't one.
+  def Find(self, key, time):
+    KeyHash = self.HashKey(key)
+    BestFileName = None
+    BestTimeDifference = None
+    for filename, (entryhash, entrytime) in self.Entries.items():
+      TimeDifference = abs(entrytime - time)
+      if((entryhash != KeyHash) or (TimeDifference > self.Window)): continue
+      if((BestFileName is None) or (TimeDifference < BestTimeDifference)):
+        BestFileName = filename
+        BestTimeDifference = TimeDifference
+    return BestFileName
+
+  # Return the stored dark image for key and time, or None if the library doesn't have one.
+  def Lookup(self, key, time):
+    FileName = self.Find(key, time)
+    if(FileName is None): return None
+    try:
+      DarkFile = h5py.File(os.path.join(self.LibraryDir, FileName), "r")
+    except IOError:
+      # Somebody else evicted it since we last looked.
+      del self.Entries[FileName]
+      return None
+    KeyMatches = (str(DarkFile.attrs["Key"]) == key)
+    DarkImage = DarkFile["DarkImage"][...]
+    DarkFile.close()
+    if(not KeyMatches): return None
+    self.MarkUsed(FileName)
+    return DarkImage
+
+  # File darkimage away under key and time, then trim the library back down to size.
+  def Store(self, key, time, darkimage, sourcefile=""):
+    FileName = "Dark_" + self.HashKey(key) + "_" + str(int(time)) + ".hdf5"
+    FilePath = os.path.join(self.LibraryDir, FileName)
+    DarkFile = h5py.File(FilePath + ".tmp", "w")
+    DarkFile.create_dataset("DarkImage", data=darkimage, compression="gzip", shuffle=True)
+    DarkFile.attrs["Key"] = key
+    DarkFile.attrs["Time"] = time
+    DarkFile.attrs["SourceFile"] = sourcefile
+    DarkFile.close()
+    os.rename(FilePath + ".tmp", FilePath)
+    self.Entries[FileName] = (self.HashKey(key), int(time))
+    self.Evict()
+
+  def MarkUsed(self, filename):
+    try:
+      os.utime(os.path.join(self.LibraryDir, filename), None)
+    except OSError:
+      pass
+
+  # Delete the least recently used darks until there are no more than MaxEntries of them left.
+  def Evict(self):
+    if(len(self.Entries) <= self.MaxEntries): return
+    LastUsed = []
+    for filename in self.Entries:
+      try:
+        LastUsed.append((os.path.getmtime(os.path.join(self.LibraryDir, filename)), filename))
+      except OSError:
+        LastUsed.append((0., filename))
+    LastUsed.sort()
+    for lastused, filename in LastUsed[:len(self.Entries) - self.MaxEntries]:
+      print "\tDropping least recently used dark image", filename, "from the dark library."
+      try:
+        os.remove(os.path.join(self.LibraryDir, filename))
+      except OSError:
+        pass
+      del self.Entries[filename]
@@ -0,0 +1,269 @@
+#!/usr/bin/python
+
+###################################################################################################
+# Support functions for writing quick previews of TEAM detector frames as png files, straight from #
+# the pixel values through a colormap lookup table, without building a matplotlib figure.         #
+###################################################################################################
+
+import struct
+import zlib
+import numpy as np
+import matplotlib
+import matplotlib.cm
+import matplotlib.colors
+import PythonTools
+
+# The previews are 8 bit palette pngs: the first nColorLevels entries of the palette are the colormap,
+# and the rest are solid colors for marking hits and clusters, named the same way matplotlib names
+# them.
+nColorLevels = 248
+MarkerColors = "bgrcmykw"
+
+# Make the palette for the previews out of a matplotlib colormap (the same default one that imshow
+# uses if colormap is None), as an (256, 3) uint8 array.
+def MakePalette(colormap=None):
+  if(colormap is None): colormap = matplotlib.rcParams['image.cmap']
+  Palette = np.zeros((256, 3), dtype=np.uint8)
+  ColormapLevels = matplotlib.cm.get_cmap(colormap)(np.linspace(0., 1., nColorLevels))[:, :3]
+  Palette[:nColorLevels] = np.round(255. * ColormapLevels)
+  for i, color in enumerate(MarkerColors):
+    Palette[nColorLevels + i] = np.round(255. * np.array(matplotlib.colors.colorConverter.to_rgb(color)))
+  return Palette
+
+# The palette index of one of the MarkerColors.
+def MarkerColorIndex(color):
+  return nColorLevels + MarkerColors.index(color)
+
+# The range of pixel values that the colormap gets stretched over: limits, if they're given as
+# [low, high], otherwise the percentiles of the pixel values (from every fourth pixel in each
+# direction, which is plenty to get them right).
+def ImageLimits(image, limits=None, percentiles=(1., 99.5)):
+  if((limits is not None) and (len(limits) == 2)): return float(limits[0]), float(limits[1])
+  Low, High = np.percentile(image[::4, ::4], percentiles)
+  if(High <= Low): High = Low + 1.
+  return float(Low), float(High)
+
+# Turn an image into colormap levels (palette indices) from 0 at low up to nColorLevels - 1 at high.
+# uint16 frames go through a lookup table over every possible pixel value, anything else gets scaled
+# directly.
+def ScaleToLevels(image, low, high):
+  Scale = (nColorLevels - 1) / (high - low)
+  if(image.dtype == np.uint16):
+    LevelTable = np.clip((np.arange(65536, dtype=np.float32) - low) * Scale, 0., nColorLevels - 1).astype(np.uint8)
+    return LevelTable[image]
+  Levels = np.subtract(image, low, dtype=np.float32)
+  Levels *= Scale
+  np.clip(Levels, 0., nColorLevels - 1, out=Levels)
+  return Levels.astype(np.uint8)
+
+# Colormap levels for a frame, scaled with ImageLimits.
+def FrameLevels(image, limits=None, percentiles=(1., 99.5)):
+  Low, High = ImageLimits(image, limits, percentiles)
+  return ScaleToLevels(image, Low, High)
+
+# Stamp a filled circle of radius pixels in one of the MarkerColors onto levels (in place) at each of
+# coords ((y, x) pixel coordinates), clipped to the edges of the image.  All of the markers go on at
+# once with one fancy-indexed assignment.
+def StampMarkers(levels, coords, color, radius=2):
+  coords = np.round(np.asarray(coords, dtype=float).reshape(-1, 2)).astype(int)
+  dY, dX = np.mgrid[-radius:radius + 1, -radius:radius + 1]
+  InDisk = ((dY * dY) + (dX * dX)) <= (radius * radius)
+  StampYs = (coords[:, 0, np.newaxis] + dY[InDisk]).ravel()
+  StampXs = (coords[:, 1, np.newaxis] + dX[InDisk]).ravel()
+  InImage = (StampYs >= 0) & (StampYs < levels.shape[0]) & (StampXs >= 0) & (StampXs < levels.shape[1])
+  levels[StampYs[InImage], StampXs[InImage]] = MarkerColorIndex(color)
+  return levels
+
+# Stamp hit markers (small red dots, like the annotated plots) onto a copy of levels.
+def StampHits(levels, hitcoords):
+  return StampMarkers(levels.copy(), hitcoords, 'r', 2)
+
+# Stamp cluster centers (big dots with a black edge, cycling through the colors like the cluster
+# plots) onto a copy of levels.
+def StampClusters(levels, clustercenters):
+  levels = levels.copy()
+  clustercenters = np.asarray(clustercenters, dtype=float).reshape(-1, 2)
+  StampMarkers(levels, clustercenters, 'k', 10)
+  for i, color in enumerate("bgrcmyk"):
+    StampMarkers(levels, clustercenters[i::7], color, 8)
+  return levels
+
+# Tile a stack of frames into one big image, ncolumns frames across (or as close to square as it
+# gets if ncolumns is None), first frame at the top left, with any leftover tiles filled with the
+# lowest pixel value.  Good for looking over a whole file at once, from a small level of an image
+# pyramid.
+def MosaicImage(frames, ncolumns=None):
+  frames = np.asarray(frames)
+  nFrames, nRows, nColumns = frames.shape
+  if(ncolumns is None): ncolumns = int(np.ceil(np.sqrt(nFrames)))
+  nTileRows = int(np.ceil(nFrames / float(ncolumns)))
+  Tiles = np.empty((nTileRows * ncolumns, nRows, nColumns), dtype=frames.dtype)
+  Tiles[:nFrames] = frames
+  Tiles[nFrames:] = frames.min()
+  # Row zero of each frame goes at the bottom when it's written out, so flip the order of the rows of
+  # tiles to keep the first frame at the top.
+  Tiles = Tiles.reshape(nTileRows, ncolumns, nRows, nColumns)[::-1]
+  return Tiles.transpose(0, 2, 1, 3).reshape(nTileRows * nRows, ncolumns * nColumns)
+
+# Write levels (colormap levels and marker colors, as uint8) out as an 8 bit palette png.  Row zero
+# goes at the bottom, like the frames are plotted everywhere else.  Low zlib compression levels are
+# plenty for previews and a lot faster.
+def WritePNG(filepath, levels, palette, compression=1):
+  nRows, nColumns = levels.shape
+  # Every row of a png starts with a filter type byte, zero meaning no filtering.
+  RawRows = np.zeros((nRows, nColumns + 1), dtype=np.uint8)
+  RawRows[:, 1:] = levels[::-1]
+  def Chunk(chunktype, data):
+    return struct.pack(">I", len(data)) + chunktype + data + struct.pack(">I", zlib.crc32(chunktype + data) & 0xffffffff)
+  PNGFile = open(filepath, "wb")
+  PNGFile.write("\x89PNG\r\n\x1a\n")
+  PNGFile.write(Chunk("IHDR", struct.pack(">IIBBBBB", nColumns, nRows, 8, 3, 0, 0, 0)))
+  PNGFile.write(Chunk("PLTE", palette.astype(np.uint8).tostring()))
+  PNGFile.write(Chunk("IDAT", zlib.compress(RawRows.tostring(), compression)))
+  PNGFile.write(Chunk("IEND", ""))
+  PNGFile.close()
+
+# Encode levels (uint8 palette indices) as gif image data: the LZW minimum code size, then the LZW
+# codes packed into sub-blocks of up to 255 bytes, and the zero length block at the end.  Rather than
+# really compressing anything, every pixel goes in as its own 9 bit code, with a clear code every
+# nPixelsPerClear pixels so that the decoder's code table never grows past 9 bits.  That costs 9/8 of
+# a byte per pixel, but it means the whole frame gets encoded with a few vectorized operations
+# instead of a pixel by pixel loop.
+nPixelsPerClear = 250
+def GIFImageData(levels):
+  Pixels = np.ascontiguousarray(levels).ravel()
+  nPixels = len(Pixels)
+  nClears = (nPixels + nPixelsPerClear - 1) / nPixelsPerClear
+  ClearCode, EndCode = 256, 257
+  Codes = np.empty(nPixels + nClears + 1, dtype=np.uint16)
+  PixelIndecies = np.arange(nPixels)
+  Codes[PixelIndecies + (PixelIndecies / nPixelsPerClear) + 1] = Pixels
+  Codes[np.arange(nClears) * (nPixelsPerClear + 1)] = ClearCode
+  Codes[-1] = EndCode
+  # Pack the 9 bit codes into bytes, least significant bit first, eight codes (nine bytes) at a time:
+  # the first seven codes and the low bit of the eighth make up a little endian 64 bit integer, and
+  # the rest of the eighth code is the ninth byte.
+  nCodes = len(Codes)
+  Codes = np.concatenate((Codes, np.zeros((-nCodes) % 8, dtype=np.uint16))).reshape(-1, 8).astype(np.uint64)
+  CodeGroups = np.empty((len(Codes), 9), dtype=np.uint8)
+  LowBits = (Codes[:, 7] & np.uint64(1)) << np.uint64(63)
+  for i in range(7):
+    LowBits |= Codes[:, i] << np.uint64(9 * i)
+  CodeGroups[:, :8] = LowBits.astype("<u8").view(np.uint8).reshape(-1, 8)
+  CodeGroups[:, 8] = Codes[:, 7] >> np.uint64(1)
+  CodeBytes = CodeGroups.ravel()[:((9 * nCodes) + 7) / 8]
+  # And split them up into sub-blocks, each starting with its length.
+  nBlocks = (len(CodeBytes) + 254) / 255
+  Blocks = np.zeros((nBlocks, 256), dtype=np.uint8)
+  Blocks[:, 0] = 255
+  Blocks[-1, 0] = len(CodeBytes) - (255 * (nBlocks - 1))
+  BlockContents = np.zeros(nBlocks * 255, dtype=np.uint8)
+  BlockContents[:len(CodeBytes)] = CodeBytes
+  Blocks[:, 1:] = BlockContents.reshape(nBlocks, 255)
+  BlockBytes = Blocks.ravel()[:len(CodeBytes) + nBlocks]
+  return "\x08" + BlockBytes.tostring() + "\x00"
+
+# An animated gif that frames get added to one at a time, through the same palette as the png
+# previews, and written straight to the disk, so a movie of a whole file never has to be held in
+# memory.  The colormap spans limits ([low, high]), or the percentiles of the first frame's pixel
+# values if limits is empty, and stays the same for every frame so that they can be compared.  Each
+# frame shows for delay seconds, and the movie loops forever.
+class GIFMovie(object):
+  def __init__(self, filepath, palette, delay=0.1, limits=None, percentiles=(1., 99.5)):
+    self.FilePath = filepath
+    self.Palette = palette
+    self.Delay = delay
+    self.Limits = limits
+    self.Percentiles = percentiles
+    self.GIFFile = None
+    self.Shape = None
+    self.nFrames = 0
+
+  def WriteHeader(self, shape):
+    self.Shape = shape
+    nRows, nColumns = shape
+    self.GIFFile = open(self.FilePath, "wb")
+    # Logical screen descriptor with a 256 color global color table...
+    self.GIFFile.write("GIF89a" + struct.pack("<HHBBB", nColumns, nRows, 0xF7, 0, 0) + self.Palette.astype(np.uint8).tostring())
+    # ...and the Netscape extension that makes it loop.
+    self.GIFFile.write("\x21\xFF\x0BNETSCAPE2.0\x03\x01" + struct.pack("<H", 0) + "\x00")
+
+  def AddFrame(self, image):
+    if((self.Limits is None) or (len(self.Limits) != 2)):
+      self.Limits = ImageLimits(image, None, self.Percentiles)
+    self.AddLevels(ScaleToLevels(np.asarray(image), float(self.Limits[0]), float(self.Limits[1])))
+
+  # Add a frame that's already been turned into palette indices (with hits stamped on it, say).
+  def AddLevels(self, levels):
+    if(self.GIFFile is None): self.WriteHeader(levels.shape)
+    if(levels.shape != self.Shape):
+      raise ValueError("All of the frames in " + self.FilePath + " need to be " + str(self.Shape) + ", not " + str(levels.shape) + ".")
+    nRows, nColumns = levels.shape
+    # Graphic control extension (for the delay), image descriptor, and the image, upside down so row
+    # zero ends up at the bottom.
+    self.GIFFile.write("\x21\xF9\x04\x00" + struct.pack("<H", int(round(100. * self.Delay))) + "\x00\x00")
+    self.GIFFile.write("\x2C" + struct.pack("<HHHHB", 0, 0, nColumns, nRows, 0))
+    self.GIFFile.write(GIFImageData(levels[::-1]))
+    self.nFrames += 1
+
+  def Close(self):
+    if(self.GIFFile is None): return
+    self.GIFFile.write("\x3B")
+    self.GIFFile.close()
+    self.GIFFile = None
+
+# The frame that goes into a movie for image: its block mean down to size rows (like a level of the
+# image pyramids), or the whole image if it can't be evenly shrunk down to that.
+def MovieFrame(image, size):
+  return PythonTools.ImagePyramid(image, [size]).get((size, "Mean"), image)
+
+# Write a gif movie of a stack of frames, which can be an array or a dataset in an hdf5 file, since
+# the frames get read (and written) one at a time.
+def WriteGIFMovie(filepath, frames, palette, delay=0.1, limits=None, percentiles=(1., 99.5)):
+  Movie = GIFMovie(filepath, palette, delay, limits, percentiles)
+  for i in range(len(frames)):
+    Movie.AddFrame(frames[i])
+  Movie.Close()
+  return Movie.nFrames
+
+# How frame previews get drawn: "png" writes them straight out with WritePNG, "pyplot" makes the full
+# matplotlib figures, with axes, titles and a colorbar (which is a lot slower).
+PreviewWriters = ["png", "pyplot"]
+
+# Draws the raw, dark corrected and cluster previews of frames, one way or the other (see
+# PreviewWriters), so that ReadTEAMData.py and RenderTEAMData.py draw them the same way.  The png
+# previews scale raw frames over rawlimits and dark corrected ones over dclimits, or over the
+# percentiles of each frame's pixel values if those are empty.
+class FramePreviewer(object):
+  def __init__(self, writer, extent, xtitle, ytitle, rawlimits=None, dclimits=None, percentiles=(1., 99.5), colormap=None):
+    if(writer not in PreviewWriters):
+      raise ValueError("Unknown preview writer \'" + writer + "\'.  Pick one of: " + ", ".join(PreviewWriters) + ".")
+    self.Writer = writer
+    self.Extent = extent
+    self.xTitle = xtitle
+    self.yTitle = ytitle
+    self.RawLimits = rawlimits
+    self.DCLimits = dclimits
+    self.Percentiles = percentiles
+    self.Palette = MakePalette(colormap)
+
+  def Raw(self, rawimage, plottitle, plotfilepath):
+    if(self.Writer == "pyplot"):
+      PythonTools.PlotImage(rawimage, self.Extent, plottitle, self.xTitle, self.yTitle, plotfilepath)
+    else:
+      WritePNG(plotfilepath, FrameLevels(rawimage, self.RawLimits, self.Percentiles), self.Palette)
+
+  # The dark corrected frame on its own, and with the hits at hitcoords marked on it.
+  def DarkCorrected(self, dcimage, plottitle, plotfilepath, annotatedplotfilepath, hitcoords):
+    if(self.Writer == "pyplot"):
+      PythonTools.PlotDCImage(dcimage, self.Extent, plottitle, self.xTitle, self.yTitle, plotfilepath, annotatedplotfilepath, hitcoords)
+    else:
+      Levels = FrameLevels(dcimage, self.DCLimits, self.Percentiles)
+      WritePNG(plotfilepath, Levels, self.Palette)
+      WritePNG(annotatedplotfilepath, StampHits(Levels, hitcoords), self.Palette)
+
+  def Clusters(self, dcimage, plotfilepath, clustercenters):
+    if(self.Writer == "pyplot"):
+      PythonTools.PlotClustersImage(dcimage, self.Extent, self.xTitle, self.yTitle, plotfilepath, clustercenters)
+    else:
+      WritePNG(plotfilepath, StampClusters(FrameLevels(dcimage, self.DCLimits, self.Percentiles), clustercenters), self.Palette)
@@ -39,6 +39,15 @@ def MakePixValHisto(histoname, histotitle, nbins, xlo, xhi, color):
   PixValHisto.GetYaxis().SetLabelSize(AxisLabelSize)
   return PixValHisto
 
+# Copy a PythonTools.Histogram1D into a new pixel value TH1D with the same binning, contents and
+# errors, a whole array at a time (with zeros for the under and overflow bins).
+def MakePixValHistoFromHistogram(histoname, histotitle, histogram, color):
+  PixValHisto = MakePixValHisto(histoname, histotitle, histogram.nBins, histogram.xLo, histogram.xHi, color)
+  PixValHisto.SetContent(array.array('d', [0.] + list(histogram.Values) + [0.]))
+  PixValHisto.SetError(array.array('d', [0.] + list(histogram.Errors()) + [0.]))
+  PixValHisto.SetEntries(histogram.Values.sum())
+  return PixValHisto
+
 # Construct a peak model taken from RadWare, a tool often used in HPGe detector analysis...
 def GetRWFitModel(fitmodelname, templatehisto, mean, sigm):
   # Set some basic parameter limits...
@@ -0,0 +1,118 @@
+#!/usr/bin/python
+
+####################################################################################################
+# Rebuild the Sum(N) spectra for a bunch of files from the hit tables that ReadTEAMData.py saved,  #
+# instead of from the raw .dat files.  The binning, the cuts and the range of frames can all be    #
+# picked on the command line, and the files get worked through in parallel, so trying out a new   #
+# binning over a whole campaign only takes a few seconds.                                          #
+####################################################################################################
+
+# Header, import statements etc.
+import time
+import sys
+import glob
+import multiprocessing
+import h5py
+import matplotlib.pyplot as plt
+import PythonTools
+import PythonTools_IO
+
+####################################
+#  BEGIN MAIN BODY OF THE CODE!!!  #
+####################################
+
+# Get the start time of this calculation
+StartTime = time.time()
+
+# Run options.  Change these from the command line by adding "Name=Value" arguments after the path,
+# e.g. "xStep=5".
+RunOptions = {}
+RunOptions["xLo"] = -500.#Low edge of the first bin [ADC counts]
+RunOptions["xHi"] = 3950.#High edge of the last bin [ADC counts]
+RunOptions["xStep"] = 10.#Bin width [ADC counts]
+RunOptions["MinSum1"] = 80.#Only count hits whose central pixel is above this (LocalMaxThreshold in ReadTEAMData.py)
+RunOptions["GoodClustersOnly"] = True#Count Sum(9)/Sum(25) boxes with nothing above SumNThreshold as zeros, like ReadTEAMData.py
+RunOptions["FirstFrame"] = 0#First frame (or mode 3 pair) of each file to use
+RunOptions["LastFrame"] = -1#Last frame (or mode 3 pair) of each file to use (-1 for all of them)
+RunOptions["nProcesses"] = multiprocessing.cpu_count()#How many files to work on at once
+RunOptions["OutputName"] = "ReHistogrammedSumSpectra"#Name of the output files, which go next to the first .dat file
+
+# Check for the appropriate number of arguments, and proceed if everything looks OK.
+if(len(sys.argv) < 2):
+  print "\tUSAGE: python ReHistogramTEAMData.py \"/path/to/the/list/of/TEAM/Detector/imges\" [Name=Value ...]"
+  print "\t         (Don\'t use a \'~\' because it doesn't work with the glob package.)"
+  print "\t         Run options and their defaults:", RunOptions
+  exit()
+try:
+  RunOptions = PythonTools.ParseRunOptions(sys.argv[2:], RunOptions)
+except ValueError as Error:
+  print "\t" + str(Error)
+  exit()
+# All of the spectra share this binning.  (If xStep doesn't divide the range evenly, the last bin edge
+# gets moved to the nearest whole number of steps.)
+Binning = PythonTools.Histogram1D(RunOptions["xLo"], RunOptions["xHi"], RunOptions["xStep"])
+xLo, xHi, xStep = Binning.xLo, Binning.xHi, Binning.xStep
+
+# Get a list of the .dat files that went into this analysis, and the hdf5 files that
+# ReadTEAMData.py made out of them.
+PathToImageFiles = sys.argv[1]
+print "\tReading in", PathToImageFiles + "..."
+FileNameList = sorted(glob.glob(PathToImageFiles))
+print "\t...Found", len(FileNameList), " image files.  Rebuilding Sum(N) spectra from their hit tables."
+if(len(FileNameList) == 0): exit()
+HDF5FileList = [PythonTools_IO.OutputFilePath(name) for name in FileNameList]
+
+# Histogram the hit tables, a few files at a time, and add up the spectra as they come back.
+GlobalSpectra = [Binning.Copy(), Binning.Copy(), Binning.Copy()]
+nHitsTotal = 0
+nFilesUsed = 0
+Arguments = [(filepath, Binning, RunOptions["MinSum1"], RunOptions["FirstFrame"], RunOptions["LastFrame"],
+              RunOptions["GoodClustersOnly"]) for filepath in HDF5FileList]
+Pool = multiprocessing.Pool(max(RunOptions["nProcesses"], 1))
+for filepath, spectra, nhits in Pool.imap_unordered(PythonTools_IO.ReHistogramHitTable, Arguments):
+  if(spectra is None):
+    print "\tCouldn't find a hit table in", filepath + ".  Skipping it."
+    continue
+  print "\tProcessed", filepath.split("/")[-1], "(" + str(nhits), "hits)..."
+  for globalspectrum, spectrum in zip(GlobalSpectra, spectra):
+    globalspectrum += spectrum
+  nHitsTotal += nhits
+  nFilesUsed += 1
+Pool.close()
+Pool.join()
+GlobalSum1Spectrum, GlobalSum9Spectrum, GlobalSum25Spectrum = GlobalSpectra
+print "\tUsed", nHitsTotal, "hits from", nFilesUsed, "files."
+
+# Save the spectra, along with the binning (see PythonTools_IO.SaveHistogram) and cuts that made them,
+# to an hdf5 file.
+OutputPathStem = FileNameList[0].replace(FileNameList[0].split("/")[-1], "") + RunOptions["OutputName"]
+OutputFile = h5py.File(OutputPathStem + ".hdf5", "w")
+OutputFile.create_dataset('xAxisParams', data=[xLo, xHi, xStep])
+PythonTools_IO.SaveHistogram(OutputFile, 'Sum01Vals', GlobalSum1Spectrum)
+PythonTools_IO.SaveHistogram(OutputFile, 'Sum09Vals', GlobalSum9Spectrum)
+PythonTools_IO.SaveHistogram(OutputFile, 'Sum25Vals', GlobalSum25Spectrum)
+for name in ["MinSum1", "GoodClustersOnly", "FirstFrame", "LastFrame"]:
+  OutputFile.attrs[name] = RunOptions[name]
+OutputFile.attrs["nFiles"] = nFilesUsed
+OutputFile.attrs["nHits"] = nHitsTotal
+OutputFile.close()
+
+# And plot them.
+plt.figure(num=None, figsize=(16, 9), dpi=80, facecolor='w', edgecolor='k')
+xBinCenters = Binning.BinCenters()
+plt.plot(xBinCenters, GlobalSum1Spectrum.Values,  '-', color='k', linewidth=2.0, label='Sum(1)')
+plt.plot(xBinCenters, GlobalSum9Spectrum.Values,  '-', color='b', linewidth=2.0, label='Sum(9)')
+plt.plot(xBinCenters, GlobalSum25Spectrum.Values, '-', color='r', linewidth=2.0, label='Sum(25)')
+plt.axis([xLo, xHi, 0.5, max(1., 1.05 * max([spectrum.Values.max() for spectrum in GlobalSpectra]))])
+plt.xlabel('Background Corrected ADC Value')
+plt.ylabel('Counts per ' + str(xStep) + ' ADC Unit Bin')
+plt.title('Sum(N) Histograms Rebuilt from ' + str(nFilesUsed) + ' Hit Tables')
+plt.grid(True)
+plt.yscale('log')
+plt.legend()
+plt.savefig(OutputPathStem + ".pdf")
+
+# Get the end time and report how long this calculation took
+StopTime = time.time()
+print "It took", StopTime - StartTime, "seconds for this code to run."
+exit()
@@ -2,8 +2,8 @@
 
 ####################################################################################################
 # Open a binary file file from the TEAM detector running in either trigger mode (2 or 3, selected  #
-# by command line argument).  Then read and decode it using the the data file using the struct     #
-# package, and then push it into a series of 2D histograms using imshow.  Once we have all these   #
+# by command line argument).  Then read and decode the data file with one bulk numpy read, and     #
+# then push it into a series of 2D histograms using imshow.  Once we have all these                #
 # images in a more python-friendly format, then perform a dark correction based on which trigger   #
 # mode was selected.  Once that's done, we'll go ahead and save a png image of the raw and dark    #
 # corrected images, and then write the image array to an HDF5 file.                                #
@@ -13,15 +13,21 @@
 import time
 import sys
 import os
-import struct
 import numpy as np
+import matplotlib
+# Without any plots to draw right away (PlotMode=none or deferred) there's no need for a display, so
+# keep pyplot off of the interactive backends before anything imports it.  (The run options haven't
+# been parsed yet, so this looks at the last PlotMode on the command line, like ParseRunOptions will.)
+PlotModeArguments = [argument for argument in sys.argv[3:] if argument.startswith("PlotMode=")]
+if((len(PlotModeArguments) > 0) and (PlotModeArguments[-1] != "PlotMode=all")):
+  matplotlib.use("Agg")
 import matplotlib.pyplot as plt
 import scipy.ndimage.filters as filters
-import scipy.ndimage as ndimage
 import h5py
 from sklearn.cluster import MeanShift, estimate_bandwidth
-from itertools import cycle
 import PythonTools
+import PythonTools_IO
+import PythonTools_Images
 
 ####################################
 #  BEGIN MAIN BODY OF THE CODE!!!  #
@@ -34,8 +40,92 @@ StartTime = time.time()
 Debugging = False
 VerboseProcessing = True
 
-if(len(sys.argv) != 3):
-  print "Usage: [python] ReadTEAMData_mode3.py path/to/binary/image/file TriggerMode"
+# Run options.  Change these from the command line by adding "Name=Value" arguments after the
+# trigger mode, e.g. "Follow=1".
+RunOptions = {}
+RunOptions["Follow"] = False#Process frames as they arrive while the .dat file is still being written
+RunOptions["PollInterval"] = 0.5#[s] How often to look for new frames when following a file
+RunOptions["FollowTimeout"] = 10.#[s] Stop following once the file hasn't grown for this long
+RunOptions["ExpectedFrames"] = 0#Number of frames the file should end up with (0 if unknown); following stops as soon as they're all in
+RunOptions["BlockSize"] = 4#Number of frames dark-corrected at once; this sets the peak memory use
+RunOptions["DarkEstimator"] = "median"#Mode 2 per-pixel dark estimator; see PythonTools.DarkEstimators
+RunOptions["DarkPercentile"] = 50.#Percentile used by the "percentile" dark estimator
+RunOptions["DarkTrimFraction"] = 0.1#Fraction trimmed off of each end by the "trimmedmean" dark estimator
+RunOptions["DarkClipSigma"] = 3.#Clipping threshold [std. dev.] for the "sigmaclippedmean" dark estimator
+RunOptions["DarkModelFile"] = ""#Mode 2 running dark model shared by the files in a run ("" to turn it off)
+RunOptions["DarkModelMethod"] = "quantile"#How the running dark model updates; see PythonTools.DarkModelMethods
+RunOptions["DarkModelRate"] = 0.05#How much weight each new frame gets in the running dark model
+RunOptions["DarkModelQuantile"] = 0.5#Which quantile of each pixel's values the "quantile" dark model settles on
+RunOptions["DarkModelClip"] = 5.#How many spreads a frame can pull each pixel of the running dark model by
+RunOptions["DarkLibrary"] = ""#Directory of mode 2 dark images to share between files ("" to turn it off)
+RunOptions["DarkLibraryWindow"] = 3600.#[s] Only share darks between files written within this long of each other
+RunOptions["DarkLibrarySize"] = 100#Most dark images kept in the library before the least recently used get dropped
+RunOptions["DarkKeyHeaderWords"] = []#Header words (0-8) that hold readout settings, which darks also have to match on to be shared, e.g. "1,2"
+RunOptions["CommonMode"] = False#Subtract each ADC channel's per-row baseline after the dark correction
+RunOptions["CommonModeThreshold"] = 40.#Pixels near anything above this [ADC counts] are left out of the baselines
+RunOptions["ScanLocalMaxThresholds"] = []#Local max thresholds to scan over in the same pass, e.g. "60,80,100"
+RunOptions["ScanSumNThresholds"] = []#Sum(N) thresholds to scan over in the same pass, e.g. "20,40,60"
+RunOptions["ClusterMethod"] = "fof"#How hits get grouped into clusters; see PythonTools.ClusterMethods ("none" skips it)
+RunOptions["ClusterLinkingLength"] = 5.#[pixels] Hits closer than this share a cluster with the "fof" method
+RunOptions["PlotMode"] = "all"#Draw the plots now ("all"), save what RenderTEAMData.py needs to draw them later ("deferred"), or skip them ("none")
+RunOptions["PreviewWriter"] = "png"#Draw raw and dark corrected frames as quick colormapped pngs ("png") or full figures ("pyplot")
+RunOptions["PreviewPercentiles"] = [1., 99.5]#Percentiles of each frame's pixel values that the png previews' colormap spans
+RunOptions["PreviewRawLimits"] = []#Fixed [low,high] pixel values for the raw frame png previews, instead of the percentiles
+RunOptions["PreviewDCLimits"] = []#Fixed [low,high] pixel values for the dark corrected png previews, instead of the percentiles
+RunOptions["Pyramid"] = False#Save downsampled (block mean and max) copies of every raw and dark corrected frame for quick looks
+RunOptions["PyramidSizes"] = [512, 256, 128]#Number of rows at each level of the pyramids (add the full size to keep full resolution copies too)
+RunOptions["Movies"] = False#Write animated gifs of the raw and dark corrected frames (Raw.gif and DarkCorr.gif) to review a whole file at a glance
+RunOptions["MovieSize"] = 256#Number of rows in the movie frames (block means of the frames, like the image pyramids)
+RunOptions["MovieDelay"] = 0.2#[s] How long each frame of the movies is shown for
+RunOptions["PlotSpectra"] = True#Save a pdf of each frame's Sum(N) spectra (the values go in the hdf5 file either way)
+RunOptions["ClusterTable"] = True#Save the size, charge and shape of every cluster of pixels above threshold
+RunOptions["ClusterTableThreshold"] = 40.#[ADC counts] Pixels above this make up the clusters in the cluster table
+RunOptions["Compressor"] = "gzip"#How the tables and image stacks in the hdf5 file get compressed; see PythonTools_IO.Compressors
+
+if(len(sys.argv) < 3):
+  print "Usage: [python] ReadTEAMData.py path/to/binary/image/file TriggerMode [Name=Value ...]"
+  print "       Run options and their defaults:", RunOptions
+  exit()
+try:
+  RunOptions = PythonTools.ParseRunOptions(sys.argv[3:], RunOptions)
+except ValueError as Error:
+  print "\t" + str(Error)
+  exit()
+FollowFile = RunOptions["Follow"]
+nImagesExpected = None
+if(RunOptions["ExpectedFrames"] > 0): nImagesExpected = RunOptions["ExpectedFrames"]
+BlockSize = max(RunOptions["BlockSize"], 1)
+DarkEstimator = RunOptions["DarkEstimator"]
+if(DarkEstimator not in PythonTools.DarkEstimators):
+  print "\tThe dark estimator needs to be one of", PythonTools.DarkEstimators, "not \'" + DarkEstimator + "\'."
+  exit()
+ClusterMethod = RunOptions["ClusterMethod"]
+if(ClusterMethod not in PythonTools.ClusterMethods):
+  print "\tThe cluster method needs to be one of", PythonTools.ClusterMethods, "not \'" + ClusterMethod + "\'."
+  exit()
+ClusterLinkingLength = RunOptions["ClusterLinkingLength"]
+PlotMode = RunOptions["PlotMode"]
+if(PlotMode not in PythonTools.PlotModes):
+  print "\tThe plot mode needs to be one of", PythonTools.PlotModes, "not \'" + PlotMode + "\'."
+  exit()
+MakePlots = (PlotMode == "all")
+Compressor = RunOptions["Compressor"]
+if(Compressor not in PythonTools_IO.Compressors):
+  print "\tThe compressor needs to be one of", PythonTools_IO.Compressors, "not \'" + Compressor + "\'."
+  exit()
+if(RunOptions["PreviewWriter"] not in PythonTools_Images.PreviewWriters):
+  print "\tThe preview writer needs to be one of", PythonTools_Images.PreviewWriters, "not \'" + RunOptions["PreviewWriter"] + "\'."
+  exit()
+DarkModelFilePath = RunOptions["DarkModelFile"]
+DarkKeyHeaderWords = [int(word) for word in RunOptions["DarkKeyHeaderWords"]]
+if(len([word for word in DarkKeyHeaderWords if ((word < 0) or (word >= PythonTools_IO.HeaderLength))]) > 0):
+  print "\tThe dark library can only be keyed on header words 0 to", str(PythonTools_IO.HeaderLength - 1) + ", not", DarkKeyHeaderWords
+  exit()
+if(RunOptions["DarkModelMethod"] not in PythonTools.DarkModelMethods):
+  print "\tThe dark model method needs to be one of", PythonTools.DarkModelMethods, "not \'" + RunOptions["DarkModelMethod"] + "\'."
+  exit()
+if((RunOptions["DarkModelQuantile"] <= 0.) or (RunOptions["DarkModelQuantile"] >= 1.)):
+  print "\tThe dark model quantile needs to be between 0 and 1, not", str(RunOptions["DarkModelQuantile"]) + "."
   exit()
 
 # Pull in the path to the binary file we're going to look at.
@@ -47,46 +137,54 @@ if(VerboseProcessing):
 TriggerMode = int(sys.argv[2])
 print "\tTrigger mode set to", TriggerMode
 if(TriggerMode == 2):
-  print "\tWill construct dark image from the median of each pixel value across the whole data set."
+  print "\tWill construct dark image from the", DarkEstimator, "of each pixel value across the whole data set."
 elif(TriggerMode == 3):
   print "\tWill use even image numbers (starting from zero) to dark correct odd numbered exposures."
 else:
   print "\tTrigger mode needs to be either a \'2\' or a \'3\'.  It seems to be something else..."
   exit()
 
+# Memory map the file with the images we're after.  The frame count and geometry come from the
+# header and the size of the file, and files that are truncated or the wrong size get rejected
+# right here, before we do any real work on them.  The frames come back as uint16 views and only
+# get read in from the disk when something actually touches them.  If we're following a file that
+# is still being written, wait for its header to show up and then just map what's there so far.
+if(FollowFile):
+  print "\tFollowing", InputFilePath, "and processing frames as they are written."
+  if(not PythonTools_IO.WaitForTEAMFile(InputFilePath, RunOptions["PollInterval"], RunOptions["FollowTimeout"])):
+    print "\tGave up waiting for", InputFilePath, "to show up."
+    exit()
+try:
+  ImagesInThisFile = PythonTools_IO.TEAMFile(InputFilePath, nimages=nImagesExpected, follow=FollowFile)
+except IOError as Error:
+  print "\t" + str(Error)
+  exit()
+HeaderWords = ImagesInThisFile.HeaderWords
+if((TriggerMode == 3) and (len(ImagesInThisFile) % 2 != 0) and not FollowFile):
+  print "\tMode 3 needs dark/exposure pairs, but", InputFilePath, "holds an odd number of frames (" + str(len(ImagesInThisFile)) + ")."
+  exit()
+
 # Make a directory to hold the output files as well as the raw and dark-corrected images:
 OutputDir = InputFilePath.replace(".dat", "")
 if(not(os.path.isdir(OutputDir))):
   os.system("mkdir " + OutputDir)
 RawOutputDir = InputFilePath.replace(".dat", "") + "/" + "Raw"
-if(not(os.path.isdir(RawOutputDir))):
-  os.system("mkdir " + RawOutputDir)
 DCOutputDir = InputFilePath.replace(".dat", "") + "/" + "DarkCorr"
-if(not(os.path.isdir(DCOutputDir))):
-  os.system("mkdir " + DCOutputDir)
 SSOutputDir = InputFilePath.replace(".dat", "") + "/" + "SumSpec"
-if(not(os.path.isdir(SSOutputDir))):
-  os.system("mkdir " + SSOutputDir)
+if(MakePlots):
+  for plotdir in [RawOutputDir, DCOutputDir, SSOutputDir]:
+    if(not(os.path.isdir(plotdir))):
+      os.system("mkdir " + plotdir)
 
-# Open up the file with the images we're after, and define the file structure.
-thisFile = open(InputFilePath, "rb")
-# Header information:
-HeaderLength = 9#32 bit integer words
-HeaderWordLength = 4#The header words are all 4 bytes/32 bits
-FirstHeaderFormatCode     = "<L"#First word is a little-endian, unsigned long
-RestOfTheHeaderFormatCode = "<l"#The rest are little-endian, signed long
-# Image information
-nImagesPerFile = 32
-nPixelsX = 1024
-nPixelsY = 1024
-nADCchannels = 16
-xPixelsPerReadout = nPixelsX / nADCchannels
-lSensorX = 10.#[mm]
+# Image information, as worked out from the file itself.  (When following a file, nImagesPerFile
+# gets updated again once the whole file has been written.)
+nImagesPerFile = len(ImagesInThisFile)
+nPixelsX = ImagesInThisFile.nPixelsX
+nPixelsY = ImagesInThisFile.nPixelsY
+nADCchannels = ImagesInThisFile.nADCchannels
+xPixelsPerReadout = ImagesInThisFile.xPixelsPerReadout
+lSensorX = 10.#[mm] Sensor is 10 mm x 10 mm
 lSensorY = 10.#[mm]
-lPixelX = lSensorX / float(nPixelsX)#Sensor is 10 mm x 10 mm
-lPixelY = lSensorY / float(nPixelsY)
-PixelWordLength = 2#The pixels are 16 bit/2 byte words
-PixelFormatCode = "<H"
 
 # Parameters to set up the plots of all these images we're reading in...
 xFigSize, yFigSize = 12., 9.
@@ -98,304 +196,359 @@ OutputFile = h5py.File(OutputFilePath,'w')
 OutputFile.create_dataset('FigSize', data=[xFigSize, yFigSize])
 OutputFile.create_dataset('xImageAxisTitle', data=[xAxisTitle])
 OutputFile.create_dataset('yImageAxisTitle', data=[yAxisTitle])
+OutputFile.create_dataset('HeaderWords', data=HeaderWords)
+OutputFile.attrs["InputFilePath"] = InputFilePath
+OutputFile.attrs["TriggerMode"] = TriggerMode
+OutputFile.attrs["PlotMode"] = PlotMode
+OutputFile.attrs["ImageExtent"] = [0.,lSensorX, 0.,lSensorY]
 
-# Loop over the file...  Starting with the header.
-for i in range(HeaderLength):
-  if(i == 0):
-    thisCode = FirstHeaderFormatCode
+if(MakePlots):
+  plt.figure(num=None, figsize=(xFigSize, yFigSize), dpi=80, facecolor='w', edgecolor='k')
+ImageExtent = [0.,lSensorX, 0.,lSensorY]
+FramePreviewer = PythonTools_Images.FramePreviewer(RunOptions["PreviewWriter"], ImageExtent, xAxisTitle, yAxisTitle, RunOptions["PreviewRawLimits"],
+                                                   RunOptions["PreviewDCLimits"], RunOptions["PreviewPercentiles"])
+# Save the dark image, along with the name and title for its plot, and plot it.
+def SaveDarkImage(darkimage, darkimagename, darkimagetitle):
+  DarkImageDataset = OutputFile.create_dataset('DarkImage', data=np.asarray(darkimage, dtype=np.float32),
+                                               **PythonTools_IO.CompressionOptions(Compressor))
+  DarkImageDataset.attrs["PlotName"] = darkimagename
+  DarkImageDataset.attrs["PlotTitle"] = darkimagetitle
+  if(RunOptions["Pyramid"]):
+    PythonTools_IO.SavePyramid(OutputFile, "Dark", PythonTools.ImagePyramid(darkimage, RunOptions["PyramidSizes"]), Compressor)
+  if(MakePlots):
+    PythonTools.PlotImage(darkimage, ImageExtent, darkimagetitle, xAxisTitle, yAxisTitle, OutputDir + "/" + darkimagename + ".png")
+# In mode 2, we normally need every frame to build the dark image, so go through the raw frames first
+# (as they come in, if we're following the file) and then dark correct them.  If there's a running
+# dark model from the earlier files in this run, though, we already have a dark image, so every
+# frame gets dark corrected (and folded into the model) as soon as it comes in.
+DarkModel = None
+PlotRawImagesInLoop = (TriggerMode == 3)
+if((TriggerMode == 2) and (DarkModelFilePath != "") and os.path.exists(DarkModelFilePath)):
+  print "\tUsing the running dark model in", DarkModelFilePath, "instead of building a new dark image."
+  DarkModel = PythonTools_IO.LoadDarkModel(DarkModelFilePath)
+  # The model keeps updating the way the run options say, even if the earlier files used different ones.
+  OldSettings = (DarkModel.Method, DarkModel.Rate, DarkModel.Quantile, DarkModel.nSigma)
+  NewSettings = (RunOptions["DarkModelMethod"], RunOptions["DarkModelRate"], RunOptions["DarkModelQuantile"], RunOptions["DarkModelClip"])
+  if(OldSettings != NewSettings):
+    print "\tThe running dark model was updated with (method, rate, quantile, clip) =", OldSettings, "so far.",
+    print "Switching to", NewSettings, "from here on."
+    DarkModel.Method, DarkModel.Rate, DarkModel.Quantile, DarkModel.nSigma = NewSettings
+  PlotRawImagesInLoop = True
+  DarkImage = DarkModel.DarkImage.copy()
+  DarkImageName = "RunningDarkImage"
+  DarkImageTitle = "Running Dark Image (" + DarkModel.Method + ", " + str(DarkModel.nImages) + " frames) for " + InputFilePath
+  SaveDarkImage(DarkImage, DarkImageName, DarkImageTitle)
+  RawImageSource = PythonTools_IO.IterateTEAMImages(ImagesInThisFile, FollowFile, RunOptions["PollInterval"], RunOptions["FollowTimeout"])
+  DCImageSource = PythonTools.DarkCorrectWithModelStream(RawImageSource, DarkModel, DarkImage)
+elif(TriggerMode == 2):
+  for imageNumber, thisImage in PythonTools_IO.IterateTEAMImages(ImagesInThisFile, FollowFile, RunOptions["PollInterval"], RunOptions["FollowTimeout"]):
+    if(not MakePlots): continue
+    print "\tPlotting raw image", imageNumber + 1, "out of", str(len(ImagesInThisFile)) + "..."
+    # Now that we've got the most recent raw image, let's plot it and save it to a png file.
+    thisPlotTitle = "Image from TEAM Detector at Time Stamp: " + str(thisImage[0][1])
+    ImagePlotFilePath = RawOutputDir + "/TEAMimage_" + str(imageNumber) + ".png"
+    FramePreviewer.Raw(thisImage, thisPlotTitle, ImagePlotFilePath)
+  # And now, let's get the dark image (out of the dark library if there's a matching one in there,
+  # otherwise by building it), and then dark correct the raw images a block at a time as we go along.
+  DarkImage = None
+  if(RunOptions["DarkLibrary"] != ""):
+    DarkLibrary = PythonTools_IO.DarkLibrary(RunOptions["DarkLibrary"], RunOptions["DarkLibraryWindow"], RunOptions["DarkLibrarySize"],
+                                             keyheaderwords=DarkKeyHeaderWords)
+    DarkDescription = PythonTools.DescribeDarkEstimator(DarkEstimator, RunOptions["DarkPercentile"],
+                                                        RunOptions["DarkTrimFraction"], RunOptions["DarkClipSigma"])
+    DarkKey = DarkLibrary.MakeKey(ImagesInThisFile, DarkDescription)
+    DarkTime = ImagesInThisFile.Info["ModificationTime"]
+    DarkImage = DarkLibrary.Lookup(DarkKey, DarkTime)
+    if(DarkImage is not None):
+      print "\tUsing the matching dark image from the dark library in", RunOptions["DarkLibrary"] + "."
+  if(DarkImage is None):
+    DarkImage = PythonTools.MakeDarkImage(ImagesInThisFile, DarkEstimator, RunOptions["DarkPercentile"],
+                                          RunOptions["DarkTrimFraction"], RunOptions["DarkClipSigma"])
+    if(RunOptions["DarkLibrary"] != ""): DarkLibrary.Store(DarkKey, DarkTime, DarkImage, InputFilePath)
+  if(DarkEstimator == "median"):
+    DarkImageName = "MedianDarkImage"
+    DarkImageTitle = "Median Dark Image for " + InputFilePath
   else:
-    thisCode = RestOfTheHeaderFormatCode
-  thisValue = struct.unpack(thisCode, thisFile.read(HeaderWordLength))
-  #print thisValue[0]
-# Now, read the raw images...
-ImagesInThisFile = []
-plt.figure(num=None, figsize=(xFigSize, yFigSize), dpi=80, facecolor='w', edgecolor='k')
-for imageNumber in range(nImagesPerFile):
-  print "\tReading in image", imageNumber + 1, "out of", str(nImagesPerFile) + "..."
-  thisImage = []
-  for row in range(nPixelsY):
-    thisRow = [0] * nPixelsX
-    thisRow = np.array(thisRow)
-    for col in range(nPixelsX):
-      thisPixelValue = int(struct.unpack(PixelFormatCode, thisFile.read(PixelWordLength))[0])
-      thisRow[col] = thisPixelValue
-    thisImage.append(thisRow)
-  thisImage = np.array(thisImage)
-  ImagesInThisFile.append(thisImage)
-  # Now that we've got the most recent raw image, let's save it to the output file and plot it.
-  #OutputFile.create_dataset('RawImage_' + str(imageNumber), data=thisImage)
-  plt.imshow(thisImage, alpha=0.75, aspect='auto', origin='lower', extent=[0.,lSensorX, 0.,lSensorY], interpolation='none')
-  plt.colorbar()
-  plt.xlabel(xAxisTitle)
-  plt.ylabel(yAxisTitle)
-  plt.title("Image from TEAM Detector at Time Stamp: " + str(thisImage[0][1]))
-  plt.grid(True)
-  # Now, save the newly reconstructed raw image to a png file.
-  ImagePlotFilePath = RawOutputDir + "/TEAMimage_" + str(imageNumber) + ".png"
-  if os.path.exists(ImagePlotFilePath):
-    print "Deleting old version of", ImagePlotFilePath
-    os.system("rm " + ImagePlotFilePath)
-  plt.savefig(ImagePlotFilePath)
-  plt.clf()
-# Now that we're done with it, close up the binary file.
-thisFile.close()
-# And convert ImagesInThisFile from a list of np.arrays to a three-dimensional np.array
-ImagesInThisFile = np.array(ImagesInThisFile)
+    DarkImageName = "DarkImage_" + DarkEstimator
+    DarkImageTitle = "Dark Image (" + DarkEstimator + ") for " + InputFilePath
+  SaveDarkImage(DarkImage, DarkImageName, DarkImageTitle)
+  DCImageSource = PythonTools.DarkCorrectMode2Stream(ImagesInThisFile, DarkImage, BlockSize)
+  # If this is the first file of a run with a running dark model, start the model off from this file.
+  if(DarkModelFilePath != ""):
+    print "\tStarting a new running dark model in", DarkModelFilePath + "."
+    DarkModel = PythonTools.MakeRunningDarkModel(ImagesInThisFile, DarkImage, RunOptions["DarkModelMethod"], RunOptions["DarkModelQuantile"], RunOptions["DarkModelRate"], RunOptions["DarkModelClip"])
 
-# And now, let's dark correct the raw images.
-if(TriggerMode == 2): 
-  DCImages, MedianDarkImage = PythonTools.DarkCorrectMode2(ImagesInThisFile)
-  MedianDarkImageName = "MedianDarkImage"
-  MedianDarkImageTitle = "Median Dark Image for " + InputFilePath
-  OutputFile.create_dataset('DarkImage', data=MedianDarkImage)
-  plt.imshow(MedianDarkImage, alpha=0.75, aspect='auto', origin='lower', extent=[0.,lSensorX, 0.,lSensorY], interpolation='none')
-  plt.colorbar()
-  plt.xlabel(xAxisTitle)
-  plt.ylabel(yAxisTitle)
-  plt.title(MedianDarkImageTitle)
-  plt.grid(True)
-  DarkImageFilePath = OutputDir + "/" + MedianDarkImageName + ".png"
-  plt.savefig(DarkImageFilePath)
-  plt.clf()
+# In mode 3, dark correct a block of dark/exposure pairs at a time with one subtraction.  If we're
+# following the file, each pair goes downstream as soon as both halves of it are available instead.
+if(TriggerMode == 3):
+  if(FollowFile):
+    DCImageSource = PythonTools.DarkCorrectMode3Stream(PythonTools_IO.IterateTEAMPairs(ImagesInThisFile, FollowFile, RunOptions["PollInterval"], RunOptions["FollowTimeout"]))
+  else:
+    DCImageSource = PythonTools.DarkCorrectMode3Blocks(ImagesInThisFile, BlockSize)
 
-if(TriggerMode == 3): DCImages = PythonTools.DarkCorrectMode3(ImagesInThisFile)
+# Optionally take out the common-mode noise each ADC channel picks up row by row, before we go
+# looking for hits.
+if(RunOptions["CommonMode"]):
+  print "\tCommon-mode correcting each row of each of the", nADCchannels, "ADC channels."
+  DCImageSource = PythonTools.CommonModeCorrectStream(DCImageSource, nADCchannels, RunOptions["CommonModeThreshold"])
 
 # Now that we have dark-corrected images, let's create the calorimetric spectra: Sum01, Sum09, and
-# Sum25.
-Sum01Spectra = []
-Sum09Spectra = []
-Sum25Spectra = []
+# Sum25.  Each frame gets histogrammed as soon as we're done with it, and added into the summed
+# spectra, so we never hold on to the values from every frame at once.
+xLo, xHi, xStep = -500., 3950., 10.
+OutputFile.create_dataset('xAxisParams',data=[xLo, xHi, xStep])
+xBins = np.arange(xLo, xHi + xStep, xStep)
+xBinCenters = [x + (0.5 * xStep) for x in xBins[:-1]]
+xHistoAxisTitle, yHistoAxisTitle = 'Background Corrected ADC Value', 'Counts per ' + str(xStep) + ' ADC Unit Bin'
+OutputFile.create_dataset('xHistoAxisTitle', data=[xHistoAxisTitle])
+OutputFile.create_dataset('yHistoAxisTitle', data=[yHistoAxisTitle])
+SummedSum01Vals = np.zeros(len(xBinCenters))
+SummedSum09Vals = np.zeros(len(xBinCenters))
+SummedSum25Vals = np.zeros(len(xBinCenters))
 LocalMaxThreshold = 80.#[ADC Counts]
 LocalMaxNeighborhood = 2
 SumNThreshold = 40.
+EdgeBoundary = 2 # Just cut away the outer 2 pixels.  We can fiddle with this later if we have to...
+# Set some thresholds to decide which clusters of hits we want to keep...
+ClusterIntegralThreshold = 1e4
+ClusterSizeThreshold = 100
+# Every hit that makes it through the data quality cuts also goes into a hit table, so that the
+# spectra can be rebuilt later with different binning or cuts without starting from the raw frames.
+HitTable = PythonTools_IO.CreateHitTable(OutputFile, "HitTable", LocalMaxThreshold=LocalMaxThreshold,
+                                         LocalMaxNeighborhood=LocalMaxNeighborhood, SumNThreshold=SumNThreshold,
+                                         EdgeBoundary=EdgeBoundary, TriggerMode=TriggerMode, compressor=Compressor)
+# The same goes for the clusters of connected pixels above threshold, along with their shapes, for
+# looking at tracks and charge sharing.
+if(RunOptions["ClusterTable"]):
+  ClusterTable = PythonTools_IO.CreateClusterTable(OutputFile, "ClusterTable", Threshold=RunOptions["ClusterTableThreshold"],
+                                                   TriggerMode=TriggerMode, compressor=Compressor)
+# So do the clusters of hits that pass the cluster cuts.
+if(ClusterMethod != "none"):
+  HitClusterTable = PythonTools_IO.CreateTable(OutputFile, "HitClusterTable", PythonTools.HitClusterTableType, ClusterMethod=ClusterMethod,
+                                               ClusterLinkingLength=ClusterLinkingLength, ClusterIntegralThreshold=ClusterIntegralThreshold,
+                                               ClusterSizeThreshold=ClusterSizeThreshold, compressor=Compressor)
+# With deferred plotting, keep the dark corrected frames for RenderTEAMData.py to plot later.  (The
+# stack gets made once we see the first frame and know what type they come in.)
+DCImageStack = None
+# Each frame's Sum(N) spectra go in a single (frames, bins) dataset per N, a row at a time.
+PythonTools_IO.CreateSpectraStacks(OutputFile, PythonTools.Histogram1D(xLo, xHi, xStep), compressor=Compressor)
+# If we're scanning the thresholds, the spectra and hit counts for every combination of them get
+# added up here.  An empty list just means we stick with the usual value for that threshold.
+ScanLocalMaxThresholds = RunOptions["ScanLocalMaxThresholds"]
+ScanSumNThresholds = RunOptions["ScanSumNThresholds"]
+ThresholdScan = ((len(ScanLocalMaxThresholds) > 0) or (len(ScanSumNThresholds) > 0))
+if(len(ScanLocalMaxThresholds) == 0): ScanLocalMaxThresholds = [LocalMaxThreshold]
+if(len(ScanSumNThresholds) == 0): ScanSumNThresholds = [SumNThreshold]
+ScanSpectra = np.zeros((len(ScanLocalMaxThresholds), len(ScanSumNThresholds), 3, len(xBinCenters)))
+ScanCounts = np.zeros((len(ScanLocalMaxThresholds), len(ScanSumNThresholds), 3), dtype=int)
+if(ThresholdScan):
+  print "\tScanning local max thresholds", ScanLocalMaxThresholds, "and Sum(N) thresholds", ScanSumNThresholds, "in the same pass."
+# Stream the raw and dark corrected frames into their movies as they go by, all through the same
+# colormap so the frames can be compared.
+if(RunOptions["Movies"]):
+  RawMovie = PythonTools_Images.GIFMovie(OutputDir + "/Raw.gif", FramePreviewer.Palette, RunOptions["MovieDelay"],
+                                         RunOptions["PreviewRawLimits"], RunOptions["PreviewPercentiles"])
+  DCMovie = PythonTools_Images.GIFMovie(OutputDir + "/DarkCorr.gif", FramePreviewer.Palette, RunOptions["MovieDelay"],
+                                        RunOptions["PreviewDCLimits"], RunOptions["PreviewPercentiles"])
 # Step over the dark-corrected images...
-imageNumber = -1
-for dcimage in DCImages:
-  imageNumber += 1
-  print "\tCreating Sum(N) spectra for dark corrected image", imageNumber + 1, "out of", str(len(DCImages)) + "..."
+for imageNumber, dcimage in DCImageSource:
+  # The raw frame(s) that went into this dark-corrected image.
+  RawImageNumbers = [imageNumber]
+  if(TriggerMode == 3): RawImageNumbers = [2 * imageNumber, 2 * imageNumber + 1]
+  # Save the image pyramids of the raw frame(s) and this dark corrected image.
+  if(RunOptions["Pyramid"]):
+    for rawImageNumber in RawImageNumbers:
+      PythonTools_IO.AppendToPyramid(OutputFile, "Raw", PythonTools.ImagePyramid(ImagesInThisFile[rawImageNumber], RunOptions["PyramidSizes"]), Compressor)
+    PythonTools_IO.AppendToPyramid(OutputFile, "DC", PythonTools.ImagePyramid(dcimage, RunOptions["PyramidSizes"]), Compressor)
+  if(RunOptions["Movies"]):
+    for rawImageNumber in RawImageNumbers:
+      RawMovie.AddFrame(PythonTools_Images.MovieFrame(ImagesInThisFile[rawImageNumber], RunOptions["MovieSize"]))
+    DCMovie.AddFrame(PythonTools_Images.MovieFrame(dcimage, RunOptions["MovieSize"]))
+  # Plot the raw frame(s), unless we already did up above.
+  if(MakePlots and PlotRawImagesInLoop):
+    for rawImageNumber in RawImageNumbers:
+      thisImage = ImagesInThisFile[rawImageNumber]
+      thisPlotTitle = "Image from TEAM Detector at Time Stamp: " + str(thisImage[0][1])
+      ImagePlotFilePath = RawOutputDir + "/TEAMimage_" + str(rawImageNumber) + ".png"
+      FramePreviewer.Raw(thisImage, thisPlotTitle, ImagePlotFilePath)
+  print "\tCreating Sum(N) spectra for dark corrected image", str(imageNumber + 1) + "..."
   # First, make a list of the local maxima in each image.
   frameMaxima = filters.maximum_filter(dcimage, LocalMaxNeighborhood)
-  # This is a mask with the same shape as the image that has Boolean values for each pixel to
-  # denote the presence of a local mximum or not.
-  LocalMaxMask = (dcimage == frameMaxima)
-  # This is a similar image mask to make the threshold cut.
-  ThresholdMask = ((dcimage) > LocalMaxThreshold)
-  # Now we apply the threshold cut to the local max mask image.
-  LocalMaxMask[ThresholdMask == False] = False
-  # Now apply a unique label to every feature in LocalMaxMask, so that we can grab their
-  # coordinates in the next step.
-  LabeledMask, nFeatures = ndimage.label(LocalMaxMask)
-  # Get the coordinates of each local maximum pixel.
-  LocalMaxCoords = np.array(ndimage.center_of_mass(dcimage, LabeledMask, range(1, nFeatures + 1)))
+  # Then pick out the pixels that are local maxima (the same as the maximum filtered image) and above
+  # threshold, label each feature they make up, and get the centroid, seed pixel and so on of each
+  # one, all at once.
+  Hits = PythonTools.FindLocalMaxima(dcimage, frameMaxima, LocalMaxThreshold)
+  # If we're scanning thresholds, run the hit finder over every combination of them too, while we've
+  # got this frame and its maximum filtered image.
+  if(ThresholdScan):
+    thisScanSpectra, thisScanCounts = PythonTools.ThresholdScanFrame(dcimage, frameMaxima, ScanLocalMaxThresholds, ScanSumNThresholds,
+                                                                     nADCchannels, EdgeBoundary, xLo, xHi, xStep)
+    ScanSpectra += thisScanSpectra
+    ScanCounts += thisScanCounts
   #################################################################################################
   # DATA QUALITY CUT NUMBER 1:                                                                    #
-  # Step over the local maximum coordinates, and get rid of the ones that are too close to the    #
-  # edge of the image.                                                                            #
+  # Get rid of the local maxima that are too close to the edge of the image.                      #
   #################################################################################################
-  EdgeBoundary = 2 # Just cut away the outer 2 pixels.  We can fiddle with this later if we have to...
-  EdgePixelIndecies = []
-  for i in range(len(LocalMaxCoords)):
-    EdgeHit = False
-    if((LocalMaxCoords[i, 0] < EdgeBoundary) or (LocalMaxCoords[i, 0] >= (nPixelsY - EdgeBoundary))): EdgeHit = True
-    if((LocalMaxCoords[i, 1] < EdgeBoundary) or (LocalMaxCoords[i, 1] >= (nPixelsY - EdgeBoundary))): EdgeHit = True
-    if(EdgeHit): EdgePixelIndecies.append(i)
-  print "\tDeleted", len(EdgePixelIndecies), "hit pixels with the edge cut."
-  LocalMaxCoords = np.delete(LocalMaxCoords, EdgePixelIndecies, 0)
+  EdgeHits = PythonTools.EdgeCutMask(Hits["SeedY"], Hits["SeedX"], nPixelsY, nPixelsX, EdgeBoundary)
+  print "\tDeleted", EdgeHits.sum(), "hit pixels with the edge cut."
+  Hits = PythonTools.SelectRegions(Hits, ~EdgeHits)
   #################################################################################################
   # DATA QUALITY CUT NUMBER 2:                                                                    #
-  # Step over the remaining local maximum coordinates and see if there is a hit above threshold   #
-  # in in a different ADC channel at the same time to remove noise events.  This is done by       #
-  # in every pixel that is a multiple of xPixelsPerReadout (defined in line 70 at time of writing)#
-  # and checking if that is above threshold.                                                      #
+  # See if there is a hit above threshold in a different ADC channel at the same time to remove   #
+  # noise events.  This means checking every pixel that is a multiple of xPixelsPerReadout away   #
+  # in the same row, which PythonTools.NoiseCutMask does for all of the hits at once.             #
   #################################################################################################
-  NoiseCutPixelIndecies = []
-  for i in range(len(LocalMaxCoords)):
-    NoiseCut = False
-    for NoiseCheckPixel in range(xPixelsPerReadout, nPixelsX, xPixelsPerReadout):
-      CheckColumn = LocalMaxCoords[i, 1] + NoiseCheckPixel
-      if(CheckColumn >= nPixelsX): CheckColumn -= nPixelsX
-      if(dcimage[LocalMaxCoords[i, 0], CheckColumn] > (0.5 * LocalMaxThreshold)): NoiseCut = True
-    if(NoiseCut): NoiseCutPixelIndecies.append(i)
-  print "\tDeleted", len(NoiseCutPixelIndecies), "hit pixels with the nosie cut."
-  LocalMaxCoords = np.delete(LocalMaxCoords, NoiseCutPixelIndecies, 0)
-  # Plot the dark corrected image with the coordinates of the local maxima marked on them.
-  thisDCImageName = "DC_TEAMimage_" + str(imageNumber + 1)
-  thisDCImageTitle = "Dark-Corrected Image from TEAM Detector at Time Stamp: " + str(dcimage[0][1])
-  plt.imshow(dcimage, alpha=0.75, aspect='auto', origin='lower', extent=[0.,lSensorX, 0.,lSensorY], interpolation='none')
-  plt.colorbar()
-  plt.xlabel(xAxisTitle)
-  plt.ylabel(yAxisTitle)
-  plt.title(thisDCImageTitle)
-  plt.grid(True)
-  ImagePlotFilePath = DCOutputDir + "/" + thisDCImageName + ".png"
-  if os.path.exists(ImagePlotFilePath):
-    print "Deleting old version of", ImagePlotFilePath
-    os.system("rm " + ImagePlotFilePath)
-  plt.savefig(ImagePlotFilePath)
-  # Scale the list of x,y coordinates so that they can be plotted over the existing image, and then do so.
-  #print LocalMaxCoords
-  LocalMaxDisplayX = LocalMaxCoords[:, 1] * ((lSensorX) / dcimage.shape[1]) + (0.5 * lPixelX)
-  LocalMaxDisplayY = LocalMaxCoords[:, 0] * ((lSensorY) / dcimage.shape[0]) + (0.5 * lPixelY)
-  plt.plot(LocalMaxDisplayX, LocalMaxDisplayY, 'ro')
-  plt.title("Found " + str(len(LocalMaxDisplayX)) + " Local Maxima")
-  # Now, save the newly reconstructed dark corredted image to a png file.
-  ImagePlotFilePath = DCOutputDir + "/" + thisDCImageName + ".Annotated.png"
-  if os.path.exists(ImagePlotFilePath):
-    print "Deleting old version of", ImagePlotFilePath
-    os.system("rm " + ImagePlotFilePath)
-  plt.savefig(ImagePlotFilePath)
-  plt.clf()
+  NoiseHits = PythonTools.NoiseCutMask(dcimage, Hits["SeedY"], Hits["SeedX"], nADCchannels, 0.5 * LocalMaxThreshold)
+  print "\tDeleted", NoiseHits.sum(), "hit pixels with the nosie cut."
+  Hits = PythonTools.SelectRegions(Hits, ~NoiseHits)
+  LocalMaxCoords = np.column_stack((Hits["CentroidY"], Hits["CentroidX"]))
+  # Plot the dark corrected image with the coordinates of the local maxima marked on them, or save it
+  # so that it can be plotted later.
+  if(MakePlots):
+    thisDCImageName = "DC_TEAMimage_" + str(imageNumber + 1)
+    thisDCImageTitle = "Dark-Corrected Image from TEAM Detector at Time Stamp: " + str(dcimage[0][1])
+    FramePreviewer.DarkCorrected(dcimage, thisDCImageTitle, DCOutputDir + "/" + thisDCImageName + ".png",
+                                 DCOutputDir + "/" + thisDCImageName + ".Annotated.png", LocalMaxCoords)
+  elif(PlotMode == "deferred"):
+    if(DCImageStack is None):
+      DCImageStack = PythonTools_IO.CreateImageStack(OutputFile, "DCImages", dcimage.shape, PythonTools_IO.CompactType(dcimage.dtype),
+                                                     compressor=Compressor)
+    PythonTools_IO.AppendToTable(DCImageStack, PythonTools_IO.CompactImage(dcimage)[np.newaxis])
   #################################################################################################
-  # See if we can get the sklearn clustering algorithm to do something good here...               #
+  # Group the hits into clusters to pick out the beam and diffraction spots.                      #
   #################################################################################################
-  # First, let's redraw the image we're working with
-  plt.imshow(dcimage, alpha=0.75, aspect='auto', origin='lower', interpolation='none', extent=[0.,lSensorX, 0.,lSensorY])
-  plt.colorbar()
-  plt.xlabel(xAxisTitle)
-  plt.ylabel(yAxisTitle)
-  #plt.title(thisDCImageTitle)
-  plt.grid(True)
-  # Set some thresholds to decide which clusters we want to keep...
-  ClusterIntegralThreshold = 1e4
-  ClusterSizeThreshold = 100
-  # Estimate the bandwidth of this image.  The "quantile" argument changes how sensitive the
-  # clustering algorithm is to fainter clusters.  Leave this around 0.3-0.5 to find the beam and
-  # diffraction spots.  Dial it down to 0.1 to pick up a bunch of single electron scatters.  0.7
-  # and higher seems to drop the diffraction spots, but they are still bright enough to drag the 
-  # remaining cluster off of the main beam spot.  We should stick with something around 0.4 for
-  # now.  "n_samples" sets how long the bandwidth estimator looks around to when trying to decide
-  # how granular the image is.  500 or so seems to be fine, but pushing up as high as 200 doesn't
-  # seem to slow things down much for these file sizes.
-  bandwidth = estimate_bandwidth(LocalMaxCoords, quantile=0.4, n_samples=500)
-  print "\tThe bandwidth for image number " + str(imageNumber) + " was estemated at: " + str(bandwidth) + "."
-  # Construct the MeanShift object.
-  ms = MeanShift(bandwidth=bandwidth, bin_seeding=True)
-  # This actually does the clustering.
-  ms.fit(LocalMaxCoords)
-  # Get the labels for each point.
-  labels = ms.labels_
-  # And pull up the cluster centers.
-  cluster_centers = ms.cluster_centers_
-  # Figure out how many unique clusters we tracked down.
-  labels_unique = np.unique(labels)
-  n_clusters_ = len(labels_unique)
-  print"\tFound " + str(n_clusters_), "clusters in image", imageNumber
-  RealClusters = []
-  colors = cycle('bgrcmykbgrcmykbgrcmykbgrcmyk')
-  for k, col in zip(range(n_clusters_), colors):
-    cluster_center = cluster_centers[k]
-    my_members = labels == k
-    #plt.plot(LocalMaxCoords[my_members, 0], LocalMaxCoords[my_members, 1], col + '.')
-    ClusterIntegral = dcimage[LocalMaxCoords[my_members, 0].astype(int), LocalMaxCoords[my_members, 1].astype(int)].sum()
-    nPixelsInCluster = dcimage[LocalMaxCoords[my_members, 0].astype(int), LocalMaxCoords[my_members, 1].astype(int)].size
-    GoodCluster = False
-    if((ClusterIntegral > ClusterIntegralThreshold) and (nPixelsInCluster > ClusterSizeThreshold)): GoodCluster = True
-    print "\t\tIntegral of pixel values in cluster", k, "is", ClusterIntegral, "in", nPixelsInCluster, "pixels."
-    if GoodCluster:
-      print "\t\t\tWe're keeping this one."
-      ClusterDisplayX = cluster_center[1] * ((lSensorX) / dcimage.shape[1]) + (0.5 * lPixelX)
-      ClusterDisplayY = cluster_center[0] * ((lSensorY) / dcimage.shape[0]) + (0.5 * lPixelY)
-      RealClusters.append([ClusterDisplayX, ClusterDisplayY])
-      plt.plot(ClusterDisplayX, ClusterDisplayY, 'o', markerfacecolor=col, markeredgecolor='k', markersize=14)
+  if(ClusterMethod != "none"):
+    if(ClusterMethod == "meanshift"):
+      # Estimate the bandwidth of this image.  The "quantile" argument changes how sensitive the
+      # clustering algorithm is to fainter clusters.  Leave this around 0.3-0.5 to find the beam and
+      # diffraction spots.  Dial it down to 0.1 to pick up a bunch of single electron scatters.  0.7
+      # and higher seems to drop the diffraction spots, but they are still bright enough to drag the
+      # remaining cluster off of the main beam spot.  We should stick with something around 0.4 for
+      # now.  "n_samples" sets how long the bandwidth estimator looks around to when trying to decide
+      # how granular the image is.  500 or so seems to be fine, but pushing up as high as 200 doesn't
+      # seem to slow things down much for these file sizes.
+      bandwidth = estimate_bandwidth(LocalMaxCoords, quantile=0.4, n_samples=500)
+      print "\tThe bandwidth for image number " + str(imageNumber) + " was estemated at: " + str(bandwidth) + "."
+      # Construct the MeanShift object.
+      ms = MeanShift(bandwidth=bandwidth, bin_seeding=True)
+      # This actually does the clustering.
+      ms.fit(LocalMaxCoords)
+      # Get the labels for each point, and pull up the cluster centers.
+      labels = ms.labels_
+      cluster_centers = ms.cluster_centers_
     else:
-      print "\t\t\tAnd we're discarding it."
-  print"\tAnd", len(RealClusters), "of those", str(n_clusters_), "passed our cuts..."
-  plt.title("Found " + str(len(RealClusters)) + " Clusters")
-  ImagePlotFilePath = DCOutputDir + "/" + thisDCImageName + ".Clusters.png"
-  plt.savefig(ImagePlotFilePath)
-  plt.clf()
+      # Friends-of-friends: hits within ClusterLinkingLength pixels of each other share a cluster.
+      labels, cluster_centers = PythonTools.FriendsOfFriends(LocalMaxCoords, ClusterLinkingLength)
+    n_clusters_ = len(cluster_centers)
+    print"\tFound " + str(n_clusters_), "clusters in image", imageNumber
+    # Keep the clusters that are both bright enough and big enough.
+    ClusterIntegrals, ClusterSizes = PythonTools.ClusterSums(dcimage[Hits["SeedY"], Hits["SeedX"]], labels, n_clusters_)
+    KeptClusters = np.flatnonzero((ClusterIntegrals > ClusterIntegralThreshold) & (ClusterSizes > ClusterSizeThreshold))
+    for k in KeptClusters:
+      print "\t\tIntegral of pixel values in cluster", k, "is", ClusterIntegrals[k], "in", ClusterSizes[k], "pixels.  We're keeping this one."
+    print"\tAnd", len(KeptClusters), "of those", str(n_clusters_), "passed our cuts..."
+    PythonTools_IO.AppendToTable(HitClusterTable, PythonTools.MakeHitClusterTable(imageNumber, cluster_centers[KeptClusters],
+                                                                                 ClusterIntegrals[KeptClusters], ClusterSizes[KeptClusters]))
+    if(MakePlots):
+      FramePreviewer.Clusters(dcimage, DCOutputDir + "/" + thisDCImageName + ".Clusters.png", cluster_centers[KeptClusters])
   #################################################################################################
-  # Done screwing around with clustering...                                                       #
+  # Done with the clustering...                                                                   #
   #################################################################################################
-  # Get the values of the local maxima and the surrounding pixels so that we can build up the Sum(N) spectra.
-  thisSum1Spectrum = []
-  thisSum9Spectrum = []
-  thisSum25Spectrum = []
-  for coord in LocalMaxCoords:
-    if(dcimage[coord[0]][coord[1]] > LocalMaxThreshold):
-      thisSum1Spectrum.append(dcimage[coord[0]][coord[1]])
-      # Build up the Sum(9) spectrum by collecting the values of the neighboring pixels.
-      thisSum9Val = 0.
-      GoodCluster = False
-      # Step over the 3x3 cluster and make some quality checks: make sure that at least one of the neighboring pixels is above the SumNThreshold
-      for i in range(-1, 2):
-        for j in range(-1, 2):
-          if(dcimage[coord[0] + i][coord[1] + j] > SumNThreshold): GoodCluster = True
-      # If we still have a good cluster, then add up the neighborhood and append it to the histogram queue.
-      if(GoodCluster):
-        for i in range(-1, 2):
-          for j in range(-1, 2):
-            thisSum9Val += dcimage[coord[0] + i][coord[1] + j]
-      thisSum9Spectrum.append(thisSum9Val)
-      # And now the Sum(25) spectrum and the next-to-neighboring pixels.
-      thisSum25Val = 0.
-      GoodCluster = False
-      # Step over the 5x5 cluster and make some quality checks: make sure that at least one of the neighboring pixels is above the SumNThreshold
-      for i in range(-2, 3):
-        for j in range(-2, 3):
-          if(dcimage[coord[0] + i][coord[1] + j] > SumNThreshold): GoodCluster = True
-      # If we still have a good cluster, then add up the neighborhood and append it to the histogram queue.
-      if(GoodCluster):
-        for i in range(-2, 3):
-          for j in range(-2, 3):
-            thisSum25Val += dcimage[coord[0] + i][coord[1] + j]
-      thisSum25Spectrum.append(thisSum25Val)
-  Sum01Spectra.append(thisSum1Spectrum)
-  Sum09Spectra.append(thisSum9Spectrum)
-  Sum25Spectra.append(thisSum25Spectrum)
+  # Get the values of the local maxima and the sums of the 3x3 and 5x5 boxes around them so that we
+  # can build up the Sum(N) spectra.  A box only counts if at least one of its pixels is above
+  # SumNThreshold; the ones that don't go into the spectra as zeros.
+  SumNValues, GoodClusters = PythonTools.SumNBoxValues(dcimage, Hits["SeedY"], Hits["SeedX"], [1, 3, 5], SumNThreshold)
+  if(TriggerMode == 2):
+    thisTimeStamp = ImagesInThisFile.GetTimeStamp(imageNumber)
+  else:
+    thisTimeStamp = ImagesInThisFile.GetTimeStamp(2 * imageNumber + 1)
+  PythonTools_IO.AppendToTable(HitTable, PythonTools.MakeHitTable(imageNumber, thisTimeStamp, Hits, SumNValues,
+                                                                  GoodClusters, xPixelsPerReadout))
+  AboveThreshold = (SumNValues[1] > LocalMaxThreshold)
+  thisSum1Spectrum = SumNValues[1][AboveThreshold]
+  thisSum9Spectrum = np.where(GoodClusters[3], SumNValues[3], 0.)[AboveThreshold]
+  thisSum25Spectrum = np.where(GoodClusters[5], SumNValues[5], 0.)[AboveThreshold]
+  if(RunOptions["ClusterTable"]):
+    PixelClusters = PythonTools.FindPixelClusters(dcimage, RunOptions["ClusterTableThreshold"])
+    PythonTools_IO.AppendToTable(ClusterTable, PythonTools.MakeClusterTable(imageNumber, PixelClusters))
+  # Histogram the spectra, and add them to the ones summed over each frame.
+  thisSpectra = [PythonTools.FixedWidthHistogram(spectrum, xLo, xHi, xStep) for spectrum in [thisSum1Spectrum, thisSum9Spectrum, thisSum25Spectrum]]
+  SummedSum01Vals += thisSpectra[0]
+  SummedSum09Vals += thisSpectra[1]
+  SummedSum25Vals += thisSpectra[2]
+  # Save this frame's spectra.  Only the first half of the frames keep theirs, but when following a
+  # file we don't know how many frames that is yet, so the rest get trimmed off after the last one.
+  thisFrameTimeStamp = ImagesInThisFile[imageNumber][0][1]
+  PythonTools_IO.AppendToTable(OutputFile[PythonTools_IO.SpectraTimeStampsPath], [thisFrameTimeStamp])
+  for SumN, thisSpectrum in zip(["01", "09", "25"], thisSpectra):
+    PythonTools_IO.AppendToTable(OutputFile[PythonTools_IO.SpectraPath(SumN)], thisSpectrum[np.newaxis])
 
-# Now, make some histograms
-xLo, xHi, xStep = -500., 3950., 10.
-OutputFile.create_dataset('xAxisParams',data=[xLo, xHi, xStep])
-xBins = np.arange(xLo, xHi + xStep, xStep)
-xBinCenters = [x + (0.5 * xStep) for x in xBins[:-1]]
-xAxisTitle, yAxisTitle = 'Background Corrected ADC Value', 'Counts per ' + str(xStep) + ' ADC Unit Bin'
-OutputFile.create_dataset('xHistoAxisTitle', data=[xAxisTitle])
-OutputFile.create_dataset('yHistoAxisTitle', data=[yAxisTitle])
-for imageNumber in range(nImagesPerFile / 2):
+# Now that we've seen all of the frames, we know how many there were.
+nImagesPerFile = len(ImagesInThisFile)
+OutputFile.create_dataset('ImageGeometry', data=[nImagesPerFile, nPixelsY, nPixelsX, nADCchannels])
+
+# Keep the spectra of the first half of the frames, and plot them.
+nSpectra = PythonTools_IO.TrimSpectraStacks(OutputFile, nImagesPerFile / 2)
+for imageNumber in range(nSpectra):
   print "\tCreating sum spectra for image", imageNumber
-  # Sum(1)
-  thisPlotTitle = 'Sum(1) Spectrum from TEAM Detector at Time Stamp: ' + str(ImagesInThisFile[imageNumber][0][1])
-  ImagePlotFilePath = SSOutputDir + "/Sum01Spectrum" + str(imageNumber) + ".pdf"
-  if(len(Sum01Spectra[imageNumber]) == 0): Sum01Spectra[imageNumber].append(0.)
-  Sum01Vals = PythonTools.PlotHistogram(Sum01Spectra[imageNumber], xBins, 'r', thisPlotTitle, xAxisTitle, yAxisTitle, ImagePlotFilePath)
-  OutputFile.create_dataset('Sum01HistoVals_' + str(imageNumber), data=Sum01Vals)
-  # Sum(9)
-  thisPlotTitle = 'Sum(9) Spectrum from TEAM Detector at Time Stamp: ' + str(ImagesInThisFile[imageNumber][0][1])
-  ImagePlotFilePath = SSOutputDir + "/Sum09Spectrum" + str(imageNumber) + ".pdf"
-  if(len(Sum09Spectra[imageNumber]) == 0): Sum09Spectra[imageNumber].append(0.)
-  Sum09Vals = PythonTools.PlotHistogram(Sum09Spectra[imageNumber], xBins, 'g', thisPlotTitle, xAxisTitle, yAxisTitle, ImagePlotFilePath)
-  OutputFile.create_dataset('Sum09HistoVals_' + str(imageNumber), data=Sum09Vals)
-  # Sum(25)
-  thisPlotTitle = 'Sum(25) Spectrum from TEAM Detector at Time Stamp: ' + str(ImagesInThisFile[imageNumber][0][1])
-  ImagePlotFilePath = SSOutputDir + "/Sum25Spectrum" + str(imageNumber) + ".pdf"
-  if(len(Sum25Spectra[imageNumber]) == 0): Sum25Spectra[imageNumber].append(0.)
-  Sum25Vals = PythonTools.PlotHistogram(Sum25Spectra[imageNumber], xBins, 'b', thisPlotTitle, xAxisTitle, yAxisTitle, ImagePlotFilePath)
-  OutputFile.create_dataset('Sum25HistoVals_' + str(imageNumber), data=Sum25Vals)
+  if(not (MakePlots and RunOptions["PlotSpectra"])): continue
+  for SumN, color in [("01", 'r'), ("09", 'g'), ("25", 'b')]:
+    thisSpectrum, thisFrameTimeStamp = PythonTools_IO.LoadSpectrum(OutputFile, SumN, imageNumber)
+    thisPlotTitle = 'Sum(' + str(int(SumN)) + ') Spectrum from TEAM Detector at Time Stamp: ' + str(thisFrameTimeStamp)
+    ImagePlotFilePath = SSOutputDir + "/Sum" + SumN + "Spectrum" + str(imageNumber) + ".pdf"
+    PythonTools.PlotHistogramValues(xBins, thisSpectrum, color, thisPlotTitle, xHistoAxisTitle, yHistoAxisTitle, ImagePlotFilePath)
 
-# It's probably a good idea to sum up the different sum spectra over each frame.
-SummedSum01Spectrum, SummedSum09Spectrum, SummedSum25Spectrum = [], [], []
-for sum1spec  in Sum01Spectra: SummedSum01Spectrum += sum1spec
-for sum9spec  in Sum09Spectra: SummedSum09Spectrum += sum9spec
-for sum25spec in Sum25Spectra: SummedSum25Spectrum += sum25spec
+# Plot the spectra summed over all of the frames.
 # Summed Sum(1)
-thisPlotTitle = 'Sum(1) Spectrum from TEAM Detector Summed Over all frames'
-ImagePlotFilePath = OutputDir + "/SummedSum01Spectrum.pdf"
-SummedSum01Vals = PythonTools.PlotHistogram(SummedSum01Spectrum, xBins, 'r', thisPlotTitle, xAxisTitle, yAxisTitle, ImagePlotFilePath)
-OutputFile.create_dataset('SummedSum01Vals', data=SummedSum01Vals)
+if(MakePlots):
+  thisPlotTitle = 'Sum(1) Spectrum from TEAM Detector Summed Over all frames'
+  ImagePlotFilePath = OutputDir + "/SummedSum01Spectrum.pdf"
+  PythonTools.PlotHistogramValues(xBins, SummedSum01Vals, 'r', thisPlotTitle, xHistoAxisTitle, yHistoAxisTitle, ImagePlotFilePath)
+PythonTools_IO.SaveHistogram(OutputFile, 'SummedSum01Vals', PythonTools.Histogram1D(xLo, xHi, xStep, SummedSum01Vals))
 # Summed Sum(9)
-thisPlotTitle = 'Sum(9) Spectrum from TEAM Detector Summed Over all frames'
-ImagePlotFilePath = OutputDir + "/SummedSum09Spectrum.pdf"
-SummedSum09Vals = PythonTools.PlotHistogram(SummedSum09Spectrum, xBins, 'g', thisPlotTitle, xAxisTitle, yAxisTitle, ImagePlotFilePath)
-OutputFile.create_dataset('SummedSum09Vals', data=SummedSum09Vals)
+if(MakePlots):
+  thisPlotTitle = 'Sum(9) Spectrum from TEAM Detector Summed Over all frames'
+  ImagePlotFilePath = OutputDir + "/SummedSum09Spectrum.pdf"
+  PythonTools.PlotHistogramValues(xBins, SummedSum09Vals, 'g', thisPlotTitle, xHistoAxisTitle, yHistoAxisTitle, ImagePlotFilePath)
+PythonTools_IO.SaveHistogram(OutputFile, 'SummedSum09Vals', PythonTools.Histogram1D(xLo, xHi, xStep, SummedSum09Vals))
 # Summed Sum(25)
-thisPlotTitle = 'Sum(25) Spectrum from TEAM Detector Summed Over all frames'
-ImagePlotFilePath = OutputDir + "/SummedSum25Spectrum.pdf"
-SummedSum25Vals = PythonTools.PlotHistogram(SummedSum25Spectrum, xBins, 'b', thisPlotTitle, xAxisTitle, yAxisTitle, ImagePlotFilePath)
-OutputFile.create_dataset('SummedSum25Vals', data=SummedSum25Vals)
+if(MakePlots):
+  thisPlotTitle = 'Sum(25) Spectrum from TEAM Detector Summed Over all frames'
+  ImagePlotFilePath = OutputDir + "/SummedSum25Spectrum.pdf"
+  PythonTools.PlotHistogramValues(xBins, SummedSum25Vals, 'b', thisPlotTitle, xHistoAxisTitle, yHistoAxisTitle, ImagePlotFilePath)
+PythonTools_IO.SaveHistogram(OutputFile, 'SummedSum25Vals', PythonTools.Histogram1D(xLo, xHi, xStep, SummedSum25Vals))
+
+# Save the threshold scan, labelled with the thresholds, Sum(N) and bin centers that go with each
+# dimension.
+if(ThresholdScan):
+  ScanDataset = OutputFile.create_dataset('ThresholdScanSumNVals', data=ScanSpectra, **PythonTools_IO.CompressionOptions(Compressor))
+  CountsDataset = OutputFile.create_dataset('ThresholdScanCounts', data=ScanCounts)
+  Scales = [('ScanLocalMaxThresholds', ScanLocalMaxThresholds, 'LocalMaxThreshold'),
+            ('ScanSumNThresholds', ScanSumNThresholds, 'SumNThreshold'),
+            ('ScanSumN', [1, 9, 25], 'SumN'),
+            ('xBinCenters', xBinCenters, 'ADCValue')]
+  for dimension, (scalename, scalevalues, label) in enumerate(Scales):
+    OutputFile.create_dataset(scalename, data=scalevalues)
+    # (make_scale replaced dims.create_scale in h5py 2.9.)
+    if(hasattr(OutputFile[scalename], "make_scale")):
+      OutputFile[scalename].make_scale(label)
+    else:
+      OutputFile[scalename].dims.create_scale(OutputFile[scalename], label)
+    for dataset in [ScanDataset, CountsDataset]:
+      if(dimension >= len(dataset.shape)): continue
+      dataset.dims[dimension].label = label
+      dataset.dims[dimension].attach_scale(OutputFile[scalename])
+
+# Save the running dark model, now that it has seen this file too, for the next file in the run.
+if(DarkModel is not None):
+  PythonTools_IO.SaveDarkModel(DarkModel, DarkModelFilePath)
 
-# Close the hdf5 file...
+# Close the hdf5 file and the movies, and let go of the .dat file...
+if(RunOptions["Movies"]):
+  RawMovie.Close()
+  DCMovie.Close()
 OutputFile.close()
+ImagesInThisFile.Close()
 
 # Get the end time and report how long this calculation took
 StopTime = time.time()
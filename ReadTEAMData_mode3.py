@@ -13,13 +13,13 @@
 import time
 import sys
 import os
-import struct
 import numpy as np
 import matplotlib.pyplot as plt
 import scipy.ndimage.filters as filters
 import scipy.ndimage as ndimage
 import h5py
 import PythonTools
+import PythonTools_IO
 
 ####################################
 #  BEGIN MAIN BODY OF THE CODE!!!  #
@@ -57,11 +57,6 @@ if(not(os.path.isdir(SSOutputDir))):
 
 # Open up the file with the images we're after, and define the file structure.
 thisFile = open(InputFilePath, "rb")
-# Header information:
-HeaderLength = 9#32 bit integer words
-HeaderWordLength = 4#The header words are all 4 bytes/32 bits
-FirstHeaderFormatCode     = "<L"#First word is a little-endian, unsigned long
-RestOfTheHeaderFormatCode = "<l"#The rest are little-endian, signed long
 # Image information
 nImagesPerFile = 32
 nPixelsX = 1024
@@ -72,8 +67,6 @@ lSensorX = 10.#[mm]
 lSensorY = 10.#[mm]
 lPixelX = lSensorX / float(nPixelsX)#Sensor is 10 mm x 10 mm
 lPixelY = lSensorY / float(nPixelsY)
-PixelWordLength = 2#The pixels are 16 bit/2 byte words
-PixelFormatCode = "<H"
 
 # Parameters to set up the plots of all these images we're reading in...
 xFigSize, yFigSize = 12., 9.
@@ -86,29 +79,16 @@ OutputFile.create_dataset('FigSize', data=[xFigSize, yFigSize])
 OutputFile.create_dataset('xImageAxisTitle', data=[xAxisTitle])
 OutputFile.create_dataset('yImageAxisTitle', data=[yAxisTitle])
 
-# Loop over the file...  Starting with the header.
-for i in range(HeaderLength):
-  if(i == 0):
-    thisCode = FirstHeaderFormatCode
-  else:
-    thisCode = RestOfTheHeaderFormatCode
-  thisValue = struct.unpack(thisCode, thisFile.read(HeaderWordLength))
-  #print thisValue[0]
-# Now, read the raw images...
-ImagesInThisFile = []
+# Decode the header, and then all of the raw images in one bulk read.
+HeaderWords = PythonTools_IO.ReadTEAMHeader(thisFile)
+# Keep the integer type the rest of the code expects for the pixel values.
+ImagesInThisFile = PythonTools_IO.ReadTEAMImages(thisFile, nImagesPerFile, nPixelsY, nPixelsX).astype(int)
+# Now that we're done with it, close up the binary file.
+thisFile.close()
 plt.figure(num=None, figsize=(xFigSize, yFigSize), dpi=80, facecolor='w', edgecolor='k')
 for imageNumber in range(nImagesPerFile):
   print "\tProcessing image", imageNumber + 1, "out of", str(nImagesPerFile) + "..."
-  thisImage = []
-  for row in range(nPixelsY):
-    thisRow = [0] * nPixelsX
-    thisRow = np.array(thisRow)
-    for col in range(nPixelsX):
-      thisPixelValue = int(struct.unpack(PixelFormatCode, thisFile.read(PixelWordLength))[0])
-      thisRow[col] = thisPixelValue
-    thisImage.append(thisRow)
-  thisImage = np.array(thisImage)
-  ImagesInThisFile.append(thisImage)
+  thisImage = ImagesInThisFile[imageNumber]
   # Now that we've got the most recent raw image, let's save it to the output file and plot it.
   #OutputFile.create_dataset('RawImage_' + str(imageNumber), data=thisImage)
   plt.imshow(thisImage, alpha=0.75, aspect='auto', origin='lower', extent=[0.,lSensorX, 0.,lSensorY], interpolation='none')
@@ -124,21 +104,12 @@ for imageNumber in range(nImagesPerFile):
     os.system("rm " + ImagePlotFilePath)
   plt.savefig(ImagePlotFilePath)
   plt.clf()
-# Now that we're done with it, close up the binary file.
-thisFile.close()
-# And convert ImagesInThisFile from a list of np.arrays to a three-dimensional np.array
-ImagesInThisFile = np.array(ImagesInThisFile)
 
-# And now, let's dark correct the raw images.
-DCImages = []
+# And now, let's dark correct all of the raw images in one go.
+DCImages = PythonTools.DarkCorrectMode3(ImagesInThisFile)
 for imageNumber in range(0, nImagesPerFile, 2):
-  print "\tDark-correcting exposure", len(DCImages) + 1, "out of", str(nImagesPerFile / 2) + "..."
-  # Actually do the dark correction.
-  thisDCImage = np.subtract(ImagesInThisFile[imageNumber + 1], ImagesInThisFile[imageNumber])
-  # And save it to the hdf5 file.
-  OutputFile.create_dataset('DCImage_' + str(imageNumber), data=thisDCImage)
-  # Add the dark corrected image to the list of them, so we can do things with them later in the code. 
-  DCImages.append(thisDCImage)
+  # And save them to the hdf5 file.
+  OutputFile.create_dataset('DCImage_' + str(imageNumber), data=DCImages[imageNumber / 2])
 
 # Now that we have dark-corrected images, let's create the calorimetric spectra: Sum01, Sum09, and
 # Sum25.
@@ -0,0 +1,175 @@
+#!/usr/bin/python
+
+####################################################################################################
+# Draw the plots for files that ReadTEAMData.py went through with "PlotMode=deferred", straight    #
+# out of its hdf5 output (and the raw frames out of the .dat file, if it's still around).  The     #
+# plots come out the same, and in the same places, as if ReadTEAMData.py had drawn them itself, so #
+# production runs can skip the plotting and the figures somebody actually wants get drawn later.   #
+####################################################################################################
+
+# Header, import statements etc.
+import time
+import sys
+import os
+import glob
+import h5py
+import matplotlib.pyplot as plt
+import numpy as np
+import PythonTools
+import PythonTools_IO
+import PythonTools_Images
+
+####################################
+#  BEGIN MAIN BODY OF THE CODE!!!  #
+####################################
+
+# Get the start time of this calculation
+StartTime = time.time()
+
+# Run options.  Change these from the command line by adding "Name=Value" arguments after the path,
+# e.g. "PlotRaw=0".
+RunOptions = {}
+RunOptions["PlotRaw"] = True#Plot the raw frames (which needs the .dat file)
+RunOptions["PlotDarkCorrected"] = True#Plot the dark corrected frames, with their hits and clusters
+RunOptions["PlotSpectra"] = True#Plot each frame's Sum(N) spectra
+RunOptions["PreviewWriter"] = "png"#Draw the frames as quick colormapped pngs ("png") or full figures ("pyplot")
+RunOptions["PreviewPercentiles"] = [1., 99.5]#Percentiles of each frame's pixel values that the png previews' colormap spans
+RunOptions["PreviewRawLimits"] = []#Fixed [low,high] pixel values for the raw frame png previews, instead of the percentiles
+RunOptions["PreviewDCLimits"] = []#Fixed [low,high] pixel values for the dark corrected png previews, instead of the percentiles
+RunOptions["MosaicSize"] = 0#Also draw every frame of the file side by side from this level of the image pyramids, e.g. "128" (0 to skip it)
+RunOptions["Movies"] = False#Also write animated gifs of the raw and dark corrected frames (Raw.gif and DarkCorr.gif)
+RunOptions["MovieSize"] = 256#Level of the image pyramids the movie frames come from (or the full dark corrected frames if it isn't there)
+RunOptions["MovieDelay"] = 0.2#[s] How long each frame of the movies is shown for
+RunOptions["FirstFrame"] = 0#First frame (or mode 3 pair) to plot
+RunOptions["LastFrame"] = -1#Last frame (or mode 3 pair) to plot (-1 for all of them)
+
+# Check for the appropriate number of arguments, and proceed if everything looks OK.
+if(len(sys.argv) < 2):
+  print "\tUSAGE: python RenderTEAMData.py \"/path/to/the/list/of/TEAM/Detector/imges\" [Name=Value ...]"
+  print "\t         (Don\'t use a \'~\' because it doesn't work with the glob package.)"
+  print "\t         Run options and their defaults:", RunOptions
+  exit()
+try:
+  RunOptions = PythonTools.ParseRunOptions(sys.argv[2:], RunOptions)
+except ValueError as Error:
+  print "\t" + str(Error)
+  exit()
+FirstFrame, LastFrame = RunOptions["FirstFrame"], RunOptions["LastFrame"]
+if(RunOptions["PreviewWriter"] not in PythonTools_Images.PreviewWriters):
+  print "\tThe preview writer needs to be one of", PythonTools_Images.PreviewWriters, "not \'" + RunOptions["PreviewWriter"] + "\'."
+  exit()
+
+# Get a list of the .dat files that went into this analysis.
+PathToImageFiles = sys.argv[1]
+print "\tReading in", PathToImageFiles + "..."
+FileNameList = sorted(glob.glob(PathToImageFiles))
+print "\t...Found", len(FileNameList), " image files.  Drawing their plots from their hdf5 files."
+
+for filename in FileNameList:
+  HDF5FilePath = PythonTools_IO.OutputFilePath(filename)
+  if(not os.path.exists(HDF5FilePath)):
+    print "\tCouldn't find", HDF5FilePath + ".  Skipping it."
+    continue
+  print "\tProcessing", HDF5FilePath.split("/")[-1] + "..."
+  InputFile = h5py.File(HDF5FilePath, "r")
+  OutputDir = filename.replace(".dat", "")
+  RawOutputDir = OutputDir + "/" + "Raw"
+  DCOutputDir = OutputDir + "/" + "DarkCorr"
+  SSOutputDir = OutputDir + "/" + "SumSpec"
+  for plotdir in [RawOutputDir, DCOutputDir, SSOutputDir]:
+    if(not(os.path.isdir(plotdir))):
+      os.system("mkdir " + plotdir)
+  # Set up the plots the same way ReadTEAMData.py does.
+  xFigSize, yFigSize = InputFile['FigSize'][:]
+  xAxisTitle, yAxisTitle = InputFile['xImageAxisTitle'][0], InputFile['yImageAxisTitle'][0]
+  xHistoAxisTitle, yHistoAxisTitle = InputFile['xHistoAxisTitle'][0], InputFile['yHistoAxisTitle'][0]
+  xLo, xHi, xStep = InputFile['xAxisParams'][:]
+  xBins = np.arange(xLo, xHi + xStep, xStep)
+  TriggerMode = InputFile.attrs["TriggerMode"]
+  ImageExtent = list(InputFile.attrs["ImageExtent"])
+  plt.figure(num=None, figsize=(xFigSize, yFigSize), dpi=80, facecolor='w', edgecolor='k')
+  FramePreviewer = PythonTools_Images.FramePreviewer(RunOptions["PreviewWriter"], ImageExtent, xAxisTitle, yAxisTitle, RunOptions["PreviewRawLimits"],
+                                                     RunOptions["PreviewDCLimits"], RunOptions["PreviewPercentiles"])
+  # The dark image.
+  if('DarkImage' in InputFile):
+    DarkImageDataset = InputFile['DarkImage']
+    PythonTools.PlotImage(DarkImageDataset[:], ImageExtent, DarkImageDataset.attrs["PlotTitle"], xAxisTitle, yAxisTitle,
+                          OutputDir + "/" + DarkImageDataset.attrs["PlotName"] + ".png")
+  # The raw frames, straight out of the .dat file.
+  if(RunOptions["PlotRaw"]):
+    try:
+      ImagesInThisFile = PythonTools_IO.TEAMFile(InputFile.attrs["InputFilePath"])
+    except (IOError, OSError) as Error:
+      print "\t" + str(Error) + "  Skipping the raw frames."
+      ImagesInThisFile = []
+    RawFramesPerFrame = (2 if (TriggerMode == 3) else 1)
+    for rawImageNumber in range(len(ImagesInThisFile)):
+      imageNumber = rawImageNumber / RawFramesPerFrame
+      if((imageNumber < FirstFrame) or ((LastFrame >= 0) and (imageNumber > LastFrame))): continue
+      thisImage = ImagesInThisFile[rawImageNumber]
+      thisPlotTitle = "Image from TEAM Detector at Time Stamp: " + str(thisImage[0][1])
+      ImagePlotFilePath = RawOutputDir + "/TEAMimage_" + str(rawImageNumber) + ".png"
+      FramePreviewer.Raw(thisImage, thisPlotTitle, ImagePlotFilePath)
+  # The dark corrected frames, with the hits and the clusters that were kept marked on them.
+  if(RunOptions["PlotDarkCorrected"] and ('DCImages' in InputFile)):
+    Hits = InputFile['HitTable'][:]
+    HitClusters = (InputFile['HitClusterTable'][:] if ('HitClusterTable' in InputFile) else None)
+    for imageNumber in range(len(InputFile['DCImages'])):
+      if((imageNumber < FirstFrame) or ((LastFrame >= 0) and (imageNumber > LastFrame))): continue
+      print "\tPlotting dark corrected image", imageNumber + 1, "out of", str(len(InputFile['DCImages'])) + "..."
+      dcimage = InputFile['DCImages'][imageNumber]
+      thisHits = Hits[Hits["Frame"] == imageNumber]
+      thisDCImageName = "DC_TEAMimage_" + str(imageNumber + 1)
+      thisDCImageTitle = "Dark-Corrected Image from TEAM Detector at Time Stamp: " + str(dcimage[0][1])
+      FramePreviewer.DarkCorrected(dcimage, thisDCImageTitle, DCOutputDir + "/" + thisDCImageName + ".png",
+                                   DCOutputDir + "/" + thisDCImageName + ".Annotated.png", np.column_stack((thisHits["CentroidY"], thisHits["CentroidX"])))
+      if(HitClusters is not None):
+        thisClusters = HitClusters[HitClusters["Frame"] == imageNumber]
+        FramePreviewer.Clusters(dcimage, DCOutputDir + "/" + thisDCImageName + ".Clusters.png",
+                                np.column_stack((thisClusters["CenterY"], thisClusters["CenterX"])))
+  # All of the raw and dark corrected frames side by side, straight out of the image pyramids.
+  if(RunOptions["MosaicSize"] > 0):
+    for kind, limits in [("Raw", RunOptions["PreviewRawLimits"]), ("DC", RunOptions["PreviewDCLimits"])]:
+      LevelPath = PythonTools_IO.PyramidPath(kind, RunOptions["MosaicSize"], "Mean")
+      if(LevelPath not in InputFile):
+        print "\tCouldn't find", LevelPath, "in", HDF5FilePath + ".  Skipping the", kind, "mosaic (ReadTEAMData.py only saves the pyramids with \"Pyramid=1\")."
+        continue
+      Mosaic = PythonTools_Images.MosaicImage(InputFile[LevelPath][:])
+      PythonTools_Images.WritePNG(OutputDir + "/Mosaic_" + kind + "_" + str(RunOptions["MosaicSize"]) + ".png",
+                                  PythonTools_Images.FrameLevels(Mosaic, limits, RunOptions["PreviewPercentiles"]), FramePreviewer.Palette)
+  # Movies of all of the raw and dark corrected frames, streamed one frame at a time out of the image
+  # pyramids (or the full dark corrected frames).
+  if(RunOptions["Movies"]):
+    for kind, moviename, limits in [("Raw", "Raw", RunOptions["PreviewRawLimits"]), ("DC", "DarkCorr", RunOptions["PreviewDCLimits"])]:
+      LevelPath = PythonTools_IO.PyramidPath(kind, RunOptions["MovieSize"], "Mean")
+      if(LevelPath in InputFile):
+        MovieFrames = InputFile[LevelPath]
+      elif((kind == "DC") and ('DCImages' in InputFile)):
+        MovieFrames = InputFile['DCImages']
+      else:
+        print "\tCouldn't find", LevelPath, "in", HDF5FilePath + ".  Skipping the", kind, "movie (ReadTEAMData.py only saves the pyramids with \"Pyramid=1\")."
+        continue
+      PythonTools_Images.WriteGIFMovie(OutputDir + "/" + moviename + ".gif", MovieFrames, FramePreviewer.Palette, RunOptions["MovieDelay"],
+                                       limits, RunOptions["PreviewPercentiles"])
+  # Each frame's Sum(N) spectra.
+  if(RunOptions["PlotSpectra"]):
+    nSpectra = PythonTools_IO.nSavedSpectra(InputFile)
+    if(LastFrame >= 0): nSpectra = min(nSpectra, LastFrame + 1)
+    for imageNumber in range(FirstFrame, nSpectra):
+      for SumN, color in [("01", 'r'), ("09", 'g'), ("25", 'b')]:
+        thisSpectrum, thisTimeStamp = PythonTools_IO.LoadSpectrum(InputFile, SumN, imageNumber)
+        thisPlotTitle = 'Sum(' + str(int(SumN)) + ') Spectrum from TEAM Detector at Time Stamp: ' + str(thisTimeStamp)
+        ImagePlotFilePath = SSOutputDir + "/Sum" + SumN + "Spectrum" + str(imageNumber) + ".pdf"
+        PythonTools.PlotHistogramValues(xBins, thisSpectrum, color, thisPlotTitle, xHistoAxisTitle, yHistoAxisTitle, ImagePlotFilePath)
+  # And the spectra summed over all of the frames.
+  for SumN, color in [("01", 'r'), ("09", 'g'), ("25", 'b')]:
+    thisPlotTitle = 'Sum(' + str(int(SumN)) + ') Spectrum from TEAM Detector Summed Over all frames'
+    ImagePlotFilePath = OutputDir + "/SummedSum" + SumN + "Spectrum.pdf"
+    PythonTools.PlotHistogramValues(xBins, InputFile['SummedSum' + SumN + 'Vals'][:], color, thisPlotTitle, xHistoAxisTitle, yHistoAxisTitle, ImagePlotFilePath)
+  InputFile.close()
+  plt.close('all')
+
+# Get the end time and report how long this calculation took
+StopTime = time.time()
+print "It took", StopTime - StartTime, "seconds for this code to run."
+exit()